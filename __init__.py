@@ -1,8 +1,7 @@
-from .api_key import YOUTUBE_API_KEY
-import pafy
-pafy.set_api_key(YOUTUBE_API_KEY)
-print("Set API key!")
-
 import os
 mydir = os.path.dirname(os.path.abspath(__file__))
 DEFAULT_DOWNLOAD_DIR = os.path.join(mydir, "Downloads")
+DEFAULT_METADATA_CACHE = os.path.join(mydir, "metadata_cache.sqlite")
+DEFAULT_JOB_STORE = os.path.join(mydir, "jobs.sqlite")
+DEFAULT_DOWNLOAD_ARCHIVE = os.path.join(mydir, "archive.sqlite")
+DEFAULT_THUMBNAIL_DIR = os.path.join(mydir, "thumbnails")
@@ -1,3 +1,10 @@
+import sys
+
+if len(sys.argv) > 1:
+    # Anything on the command line means a headless batch run, no Kivy needed
+    from .cli import main
+    sys.exit(main(sys.argv[1:]))
+
 from .ui import YTDLApp
 
-YTDLApp().run()
\ No newline at end of file
+YTDLApp().run()
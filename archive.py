@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+
+import typing as T
+
+from . import DEFAULT_DOWNLOAD_ARCHIVE
+from .sqlitestore import SQLiteStore
+from .dirindex import output_index
+
+class ArchivedDownload(object):
+    def __init__(self, video_id: str, profile: str, path: str, size: int, completed_at: float):
+        self.video_id = video_id
+        self.profile = profile
+        self.path = path
+        self.size = size
+        self.completed_at = completed_at
+
+class DownloadArchive(SQLiteStore):
+    # Every video that's been downloaded, by video ID and format profile (see
+    # DownloadEntry.profile), and where it went. Lets a video be skipped no
+    # matter what it's called now or which folder it's headed for.
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS downloads (
+            video_id TEXT,
+            profile TEXT,
+            path TEXT,
+            size INTEGER,
+            completed_at REAL,
+            PRIMARY KEY (video_id, profile)
+        )""",
+    ]
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        # Whole archive in memory, so lookups never wait on the disk
+        self._entries: T.Optional[T.Dict[T.Tuple[str, str], ArchivedDownload]] = None
+        self._entries_lock = threading.Lock()
+
+    def _all(self) -> T.Dict[T.Tuple[str, str], ArchivedDownload]:
+        with self._entries_lock:
+            if self._entries is None:
+                rows = self.query("SELECT video_id, profile, path, size, completed_at FROM downloads")
+                self._entries = {(r[0], r[1]): ArchivedDownload(*r) for r in rows}
+            return self._entries
+
+    def get(self, video_id: T.Optional[str], profile: str) -> T.Optional[ArchivedDownload]:
+        # Only counts if the file's still there
+        if video_id is None:
+            return None
+        found = self._all().get((video_id, profile))
+        if found is None or not output_index.exists(found.path):
+            return None
+        return found
+
+    def record(self, video_id: T.Optional[str], profile: str, path: str) -> T.NoReturn:
+        if video_id is None:
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        archived = ArchivedDownload(video_id, profile, os.path.abspath(path), size, time.time())
+        self._all()[(video_id, profile)] = archived
+        self.execute(
+            "INSERT OR REPLACE INTO downloads (video_id, profile, path, size, completed_at) VALUES (?, ?, ?, ?, ?)",
+            (archived.video_id, archived.profile, archived.path, archived.size, archived.completed_at)
+        )
+
+    def forget(self, video_id: str, profile: str) -> T.NoReturn:
+        self._all().pop((video_id, profile), None)
+        self.execute("DELETE FROM downloads WHERE video_id = ? AND profile = ?", (video_id, profile))
+
+download_archive = DownloadArchive(DEFAULT_DOWNLOAD_ARCHIVE)
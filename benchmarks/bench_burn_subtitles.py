@@ -0,0 +1,99 @@
+import argparse
+import importlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import typing as T
+
+# Compares the old way of burning subtitles (video and audio both through a
+# concat filter, so the audio gets re-encoded) against what converter does
+# now (only the video is filtered, the audio mapped across and copied when
+# the container allows it), on a clip generated with lavfi.
+#
+#   python benchmarks/bench_burn_subtitles.py [--seconds 20] [--runs 3] [--json]
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(PACKAGE_DIR)
+sys.path.insert(0, os.path.dirname(PACKAGE_DIR))
+converter = importlib.import_module(f"{PACKAGE}.converter")
+
+import ffmpeg
+
+DEFAULT_SECONDS = 20
+DEFAULT_RUNS = 3
+
+def make_clip(directory: str, seconds: int) -> str:
+    # h264 + aac in an mp4, like what most downloads turn out as
+    path = os.path.join(directory, "clip.mp4")
+    video = ffmpeg.input(f"testsrc2=size=1280x720:rate=30:duration={seconds}", f="lavfi")
+    audio = ffmpeg.input(f"sine=frequency=440:sample_rate=48000:duration={seconds}", f="lavfi")
+    (
+        ffmpeg
+        .output(video, audio, path, vcodec="libx264", preset="ultrafast", acodec="aac", pix_fmt="yuv420p")
+        .global_args("-y", "-loglevel", "error")
+        .run()
+    )
+    return path
+
+def make_subtitles(directory: str, seconds: int) -> str:
+    path = os.path.join(directory, "clip.en.vtt")
+    with open(path, "w") as f:
+        f.write("WEBVTT\n\n")
+        for each_second in range(seconds):
+            f.write(f"00:{each_second // 60:02d}:{each_second % 60:02d}.000 --> 00:{each_second // 60:02d}:{each_second % 60:02d}.900\n")
+            f.write(f"Line number {each_second}\n\n")
+    return path
+
+def concat_graph(clip: str, subtitles: str, output: str):
+    # What the burn path used to build
+    strm_input = ffmpeg.input(clip)
+    strm_subbed = strm_input.video.filter("subtitles", os.path.relpath(subtitles))
+    return ffmpeg.concat(strm_subbed, strm_input.audio, v=1, a=1).output(output).global_args("-y", "-loglevel", "warning")
+
+def mapped_graph(clip: str, subtitles: str, output: str, copy_audio: bool):
+    return converter._build_output(ffmpeg.input(clip), output, False, subtitles, copy_audio=copy_audio)
+
+def time_graph(graph, runs: int) -> T.List[float]:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        graph.run(quiet=True)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def main(argv: T.Optional[T.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Time burning subtitles with and without re-encoding the audio.")
+    parser.add_argument("--seconds", type=int, default=DEFAULT_SECONDS, help="Length of the test clip")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Times to run each way")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        clip = make_clip(directory, args.seconds)
+        subtitles = make_subtitles(directory, args.seconds)
+        output = os.path.join(directory, "burned.mp4")
+
+        graphs = {
+            "concat (old)": concat_graph(clip, subtitles, output),
+            "mapped, audio re-encoded": mapped_graph(clip, subtitles, output, copy_audio=False),
+            "mapped, audio copied": mapped_graph(clip, subtitles, output, copy_audio=True),
+        }
+        results = []
+        for name, graph in graphs.items():
+            samples = time_graph(graph, args.runs)
+            results.append({"method": name, "median_s": statistics.median(samples), "min_s": min(samples), "runs": args.runs})
+
+    baseline = results[0]["median_s"]
+    if args.json:
+        print(json.dumps({"clip_seconds": args.seconds, "results": results}, indent=2))
+    else:
+        for each_result in results:
+            print(f"{each_result['method']:<28} median {each_result['median_s']:6.2f} s   min {each_result['min_s']:6.2f} s   {baseline / each_result['median_s']:4.2f}x")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import typing as T
+
+from fakeyoutube import FakeYouTubeServer, FakePafy, generate_media, fake_video_id
+
+# End to end benchmarks against a local stand-in for YouTube (see
+# fakeyoutube), so they run offline and give comparable numbers from one
+# release to the next. Covers DownloadEntry downloads, playlist listing,
+# each conversion path, tagging and queue operations at several sizes.
+# Results go out as JSON.
+#
+#   python benchmarks/bench_pipeline.py [--quick] [--output results.json]
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(PACKAGE_DIR)
+sys.path.insert(0, os.path.dirname(PACKAGE_DIR))
+
+try:
+    importlib.import_module(f"{PACKAGE}.api_key")
+except ImportError:
+    # Nothing here talks to the real API, any key will do
+    api_key = types.ModuleType(f"{PACKAGE}.api_key")
+    api_key.YOUTUBE_API_KEY = "offline-benchmark"
+    sys.modules[f"{PACKAGE}.api_key"] = api_key
+
+dlmanager = importlib.import_module(f"{PACKAGE}.dlmanager")
+converter = importlib.import_module(f"{PACKAGE}.converter")
+tagger = importlib.import_module(f"{PACKAGE}.tagger")
+metacache = importlib.import_module(f"{PACKAGE}.metacache")
+jobstore = importlib.import_module(f"{PACKAGE}.jobstore")
+archive = importlib.import_module(f"{PACKAGE}.archive")
+thumbcache = importlib.import_module(f"{PACKAGE}.thumbcache")
+scheduler = importlib.import_module(f"{PACKAGE}.scheduler")
+
+import ffmpeg
+
+QUEUE_SIZES = [10, 1000, 10000]
+
+def isolate_stores(directory: str) -> T.NoReturn:
+    # Point every on-disk store at the scratch directory, so a benchmark run
+    # never touches (or gets sped up by) the real queue and caches
+    stores = [
+        (metacache.metadata_cache, "metadata_cache.sqlite"),
+        (jobstore.job_store, "jobs.sqlite"),
+        (archive.download_archive, "archive.sqlite"),
+    ]
+    for each_store, name in stores:
+        each_store.close()
+        each_store.path = os.path.join(directory, name)
+    archive.download_archive._entries = None
+    thumbcache.thumbnail_cache.close()
+    thumbcache.thumbnail_cache.directory = os.path.join(directory, "thumbnails")
+    thumbcache.thumbnail_cache.path = os.path.join(directory, "thumbnails", "thumbnails.sqlite")
+
+def timed(target: T.Callable[[], T.Any]) -> T.Tuple[float, T.Any]:
+    started = time.perf_counter()
+    result = target()
+    return time.perf_counter() - started, result
+
+def bench_downloads(server: FakeYouTubeServer, directory: str, first_id: int, count: int, audio_only: bool, streaming: bool, timeout: float) -> T.Dict[str, T.Any]:
+    output_dir = os.path.join(directory, f"downloads-{first_id}")
+    os.makedirs(output_dir)
+    done = threading.Semaphore(0)
+    results = []
+    entries = []
+    for i in range(count):
+        entry = dlmanager.DownloadEntry()
+        entry.set_output_dir(output_dir)
+        entry.set_download_type(audio_only)
+        entry.streaming = streaming
+        entry.bind(done=lambda success: (results.append(success), done.release()))
+        entries.append(entry)
+
+    bytes_before = server.bytes_sent
+    started = time.perf_counter()
+    for i, each_entry in enumerate(entries):
+        each_entry.set_url_async(f"https://www.youtube.com/watch?v={fake_video_id(first_id + i)}")
+        each_entry.download()
+    for _ in entries:
+        if not done.acquire(timeout=timeout):
+            break
+    elapsed = time.perf_counter() - started
+    transferred = server.bytes_sent - bytes_before
+
+    paths = {}
+    for each_entry in entries:
+        paths[each_entry.conversion_path] = paths.get(each_entry.conversion_path, 0) + 1
+    return {
+        "count": count,
+        "audio_only": audio_only,
+        "streaming": streaming,
+        "succeeded": len([r for r in results if r]),
+        "seconds": elapsed,
+        "bytes": transferred,
+        "mb_per_s": transferred / (1024 * 1024) / max(elapsed, 1e-9),
+        "seconds_per_item": elapsed / max(count, 1),
+        "conversion_paths": {str(k): v for k, v in paths.items()},
+    }
+
+def bench_playlist(size: int) -> T.Dict[str, T.Any]:
+    playlist_seconds, items = timed(lambda: dlmanager.playlist_items("PLbenchmark"))
+    cold_seconds, metas = timed(lambda: dlmanager.videos_metadata(items))
+    warm_seconds, _ = timed(lambda: dlmanager.videos_metadata(items))
+    return {
+        "size": size,
+        "listed": len(items or []),
+        "resolved": len(metas),
+        "playlist_items_seconds": playlist_seconds,
+        "videos_metadata_cold_seconds": cold_seconds,
+        "videos_metadata_cached_seconds": warm_seconds,
+    }
+
+def bench_conversions(media: T.Dict[str, str], directory: str, runs: int) -> T.List[T.Dict[str, T.Any]]:
+    work_dir = os.path.join(directory, "conversions")
+    os.makedirs(work_dir, exist_ok=True)
+    # h264/aac in a container that isn't mp4, so it only needs a remux
+    mkv_path = os.path.join(work_dir, "source.mkv")
+    ffmpeg.input(media["video.mp4"]).output(mkv_path, c="copy").global_args("-y", "-loglevel", "error").run()
+    subtitles = os.path.join(work_dir, "source.en.vtt")
+    with open(subtitles, "w") as f:
+        f.write("WEBVTT\n\n")
+        for each_second in range(0, 30, 2):
+            f.write(f"00:00:{each_second:02d}.000 --> 00:00:{each_second + 1:02d}.500\nLine {each_second}\n\n")
+
+    cases = [
+        ("video mp4 -> mp4", media["video.mp4"], ".mp4", False, None),
+        ("video mkv -> mp4", mkv_path, ".mp4", False, None),
+        ("audio m4a -> mp3", media["audio.m4a"], ".mp3", True, None),
+        ("audio webm -> mp3", media["audio.webm"], ".mp3", True, None),
+        ("video mp4 -> mp4, burned subtitles", media["video.mp4"], ".mp4", False, subtitles),
+    ]
+    metadata = {"title": "Benchmark", "artist": "Benchmarks", "comment": "https://example.invalid", "video_id": fake_video_id(0)}
+    results = []
+    for name, source, ending, audio_only, burned in cases:
+        samples = []
+        paths = []
+        for each_run in range(runs):
+            run_dir = os.path.join(work_dir, f"{len(results)}-{each_run}")
+            os.makedirs(run_dir)
+            input_file = os.path.join(run_dir, f"input{os.path.splitext(source)[1]}")
+            shutil.copyfile(source, input_file)
+            seconds, output = timed(lambda: converter.convert_common(input_file, ending, audio_only, burned, report=paths.append, metadata=metadata, cover_art=media["thumb.jpg"] if audio_only else None))
+            if output is not None:
+                samples.append(seconds)
+        results.append({
+            "case": name,
+            "conversion_paths": sorted(set(str(p) for p in paths)),
+            "succeeded": len(samples),
+            "median_seconds": sorted(samples)[len(samples) // 2] if len(samples) > 0 else None,
+        })
+    return results
+
+def bench_tagging(media: T.Dict[str, str], directory: str, runs: int) -> T.List[T.Dict[str, T.Any]]:
+    work_dir = os.path.join(directory, "tagging")
+    os.makedirs(work_dir, exist_ok=True)
+    mp3_path = os.path.join(work_dir, "tagged.mp3")
+    ffmpeg.input(media["audio.m4a"]).output(mp3_path).global_args("-y", "-loglevel", "error").run()
+    opus_path = os.path.join(work_dir, "tagged.opus")
+    ffmpeg.input(media["audio.webm"]).output(opus_path, acodec="copy").global_args("-y", "-loglevel", "error").run()
+    m4a_path = os.path.join(work_dir, "tagged.m4a")
+    shutil.copyfile(media["audio.m4a"], m4a_path)
+
+    results = []
+    for each_path in [mp3_path, m4a_path, opus_path]:
+        seconds, _ = timed(lambda: [tagger.tag_file(each_path, f"Title {i}", "Benchmarks", "https://example.invalid", fake_video_id(i), media["thumb.jpg"]) for i in range(runs)])
+        results.append({"format": os.path.splitext(each_path)[1], "runs": runs, "ms_per_tag": seconds * 1000.0 / runs})
+    return results
+
+def bench_queue(size: int) -> T.Dict[str, T.Any]:
+    store = jobstore.job_store
+    store.execute("DELETE FROM jobs")
+    store._next_position = None
+
+    def make():
+        entries = []
+        for i in range(size):
+            entry = dlmanager.DownloadEntry()
+            video_id = fake_video_id(i)
+            entry.set_meta(f"https://www.youtube.com/watch?v={video_id}", metacache.VideoMeta(video_id, f"Benchmark video {i}", "Benchmarks", 30, None))
+            entries.append(entry)
+        return entries
+
+    results = {"size": size}
+    results["create_seconds"], entries = timed(make)
+    results["store_add_seconds"], _ = timed(lambda: store.add_many(entries))
+    def edit():
+        for each_entry in entries:
+            each_entry.set_title(f"Renamed {each_entry.id}")
+        store.flush()
+    results["edit_and_flush_seconds"], _ = timed(edit)
+    results["load_seconds"], loaded = timed(store.load_all)
+    results["downloadable_scan_seconds"], _ = timed(lambda: [e for e in entries if e.is_downloadable()])
+    results["duplicate_keys_seconds"], _ = timed(lambda: {e.archive_key(): e for e in entries})
+    def remove():
+        for each_entry in entries[::10]:
+            store.remove(each_entry)
+    results["remove_tenth_seconds"], _ = timed(remove)
+    results["loaded"] = len(loaded)
+    return results
+
+def git_commit() -> T.Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=PACKAGE_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv: T.Optional[T.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline end to end benchmarks for the download pipeline.")
+    parser.add_argument("--quick", action="store_true", help="Smaller everything, for a smoke test")
+    parser.add_argument("--seconds", type=int, default=None, help="Length of the generated media")
+    parser.add_argument("--downloads", type=int, default=None, help="Videos per download scenario")
+    parser.add_argument("--bandwidth", type=float, default=4.0, help="MB/s per connection from the fake server (0 for unlimited)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds before each response")
+    parser.add_argument("--playlist-size", type=int, default=1000, help="Videos in the fake playlist")
+    parser.add_argument("--runs", type=int, default=None, help="Repeats for conversions and tagging")
+    parser.add_argument("--output", default=None, help="Write the JSON results here as well as printing them")
+    args = parser.parse_args(argv)
+
+    seconds = args.seconds or (5 if args.quick else 30)
+    downloads = args.downloads or (2 if args.quick else 8)
+    runs = args.runs or (1 if args.quick else 3)
+    queue_sizes = QUEUE_SIZES[:2] if args.quick else QUEUE_SIZES
+
+    with tempfile.TemporaryDirectory() as directory:
+        isolate_stores(directory)
+        media = generate_media(os.path.join(directory, "media"), seconds)
+        server = FakeYouTubeServer(media, bandwidth=args.bandwidth * 1024 * 1024, latency=args.latency, playlist_size=args.playlist_size).start()
+        dlmanager.DATA_API_URL = server.url("/youtube/v3")
+        dlmanager._pafy_module = FakePafy(server)
+        try:
+            results = {
+                "downloads": [
+                    bench_downloads(server, directory, 0, downloads, True, True, timeout=600),
+                    bench_downloads(server, directory, 1000, downloads, True, False, timeout=600),
+                    bench_downloads(server, directory, 2000, downloads, False, True, timeout=600),
+                    bench_downloads(server, directory, 3000, downloads, False, False, timeout=600),
+                ],
+                "playlist": bench_playlist(args.playlist_size),
+                "conversions": bench_conversions(media, directory, runs),
+                "tagging": bench_tagging(media, directory, max(runs, 5)),
+                "queue": [bench_queue(n) for n in queue_sizes],
+            }
+        finally:
+            server.stop()
+            for each_store in [metacache.metadata_cache, jobstore.job_store, archive.download_archive, thumbcache.thumbnail_cache]:
+                each_store.close()
+
+    report = {
+        "format": 1,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "media_seconds": seconds,
+            "downloads": downloads,
+            "bandwidth_mb_per_s": args.bandwidth,
+            "latency_s": args.latency,
+            "playlist_size": args.playlist_size,
+            "runs": runs,
+            "parallel_downloads": scheduler.download_scheduler.max_workers(),
+            "parallel_conversions": scheduler.conversion_scheduler.max_workers(),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(text)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
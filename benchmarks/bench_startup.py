@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import typing as T
+
+# Times a cold import of the core modules, each in a fresh interpreter, and
+# exits non-zero if that goes over budget or drags in a heavy dependency
+# that's supposed to be loaded on first use.
+#
+#   python benchmarks/bench_startup.py [--budget-ms 150] [--runs 5] [--json]
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = os.path.basename(PACKAGE_DIR)
+
+# Everything the headless tools need before the first byte goes out
+CORE_MODULES = ["cli", "dlmanager", "converter", "fetcher", "metacache", "jobstore", "scheduler", "progresshub", "metrics"]
+# Only the GUI should ever pay for Kivy, and only the first download for the rest
+LAZY_MODULES = ["pafy", "youtube_dl", "requests", "ffmpeg", "mutagen", "kivy"]
+
+DEFAULT_BUDGET_MS = 150.0
+DEFAULT_RUNS = 5
+
+# api_key.py is never checked in. Nothing imported here talks to the API, so
+# a checkout without one gets a stand-in (the same as bench_pipeline).
+PROBE = """
+import sys, time, json, types
+if {stub_api_key!r}:
+    api_key = types.ModuleType("{package}.api_key")
+    api_key.YOUTUBE_API_KEY = "offline-benchmark"
+    sys.modules["{package}.api_key"] = api_key
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+def time_import(module: str) -> T.Dict[str, T.Any]:
+    stub_api_key = not os.path.isfile(os.path.join(PACKAGE_DIR, "api_key.py"))
+    code = PROBE.format(module=module, lazy=LAZY_MODULES, package=PACKAGE, stub_api_key=stub_api_key)
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(PACKAGE_DIR),
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def measure(module: str, runs: int) -> T.Dict[str, T.Any]:
+    samples = [time_import(module) for _ in range(runs)]
+    return {
+        "module": module,
+        "median_ms": statistics.median(s["seconds"] for s in samples) * 1000.0,
+        "max_ms": max(s["seconds"] for s in samples) * 1000.0,
+        "loaded": sorted(set(m for s in samples for m in s["loaded"])),
+    }
+
+def main(argv: T.Optional[T.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check the package's cold import time.")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Most any one core module may take to import (median)")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Fresh interpreters per module")
+    parser.add_argument("--gui", action="store_true", help="Also time the GUI module (never fails, Kivy is expected there)")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        results = [measure(f"{PACKAGE}.{m}", args.runs) for m in CORE_MODULES]
+        gui_results = [measure(f"{PACKAGE}.ui", args.runs)] if args.gui else []
+    except RuntimeError as err:
+        print(f"FAIL: {err}", file=sys.stderr)
+        return 1
+    failures = []
+    for each_result in results:
+        if each_result["median_ms"] > args.budget_ms:
+            failures.append(f"{each_result['module']} took {each_result['median_ms']:.1f} ms (budget {args.budget_ms:.0f} ms)")
+        if len(each_result["loaded"]) > 0:
+            failures.append(f"{each_result['module']} eagerly imports {', '.join(each_result['loaded'])}")
+    results.extend(gui_results)
+
+    if args.json:
+        print(json.dumps({"budget_ms": args.budget_ms, "results": results, "failures": failures}, indent=2))
+    else:
+        for each_result in results:
+            loaded = ", ".join(each_result["loaded"]) or "-"
+            print(f"{each_result['module']:<28} median {each_result['median_ms']:7.1f} ms   max {each_result['max_ms']:7.1f} ms   loaded: {loaded}")
+        for each_failure in failures:
+            print(f"FAIL: {each_failure}", file=sys.stderr)
+
+    return 1 if len(failures) > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
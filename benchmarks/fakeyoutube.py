@@ -0,0 +1,230 @@
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse as urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import typing as T
+
+import ffmpeg
+
+# A local stand-in for YouTube, so the pipeline can be benchmarked offline:
+#  - media made with ffmpeg's lavfi sources, served over HTTP with Range
+#    support and a configurable bandwidth (per connection) and latency
+#  - enough of the Data API (playlistItems, videos) for playlist listing
+#  - a fake pafy module that points streams at the local server
+
+VIDEO_ID_ALPHABET = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_"
+
+def fake_video_id(n: int) -> str:
+    # Always 11 characters, like the real thing
+    chars = []
+    for _ in range(11):
+        chars.append(VIDEO_ID_ALPHABET[n % len(VIDEO_ID_ALPHABET)])
+        n //= len(VIDEO_ID_ALPHABET)
+    return "".join(reversed(chars))
+
+def video_number(video_id: str) -> int:
+    n = 0
+    for each_char in video_id:
+        n = n * len(VIDEO_ID_ALPHABET) + VIDEO_ID_ALPHABET.index(each_char)
+    return n
+
+def generate_media(directory: str, seconds: int) -> T.Dict[str, str]:
+    # name -> path of each file the server hands out
+    os.makedirs(directory, exist_ok=True)
+    paths = {
+        "audio.m4a": os.path.join(directory, "audio.m4a"),
+        "audio.webm": os.path.join(directory, "audio.webm"),
+        "video.mp4": os.path.join(directory, "video.mp4"),
+        "thumb.jpg": os.path.join(directory, "thumb.jpg"),
+    }
+    tone = lambda: ffmpeg.input(f"sine=frequency=440:sample_rate=44100:duration={seconds}", f="lavfi")
+    picture = lambda: ffmpeg.input(f"testsrc2=size=640x360:rate=25:duration={seconds}", f="lavfi")
+    quiet = ("-y", "-loglevel", "error")
+
+    tone().output(paths["audio.m4a"], acodec="aac", audio_bitrate="128k").global_args(*quiet).run()
+    tone().output(paths["audio.webm"], acodec="libopus", audio_bitrate="128k").global_args(*quiet).run()
+    ffmpeg.output(picture(), tone(), paths["video.mp4"], vcodec="libx264", preset="ultrafast", pix_fmt="yuv420p", acodec="aac").global_args(*quiet).run()
+    ffmpeg.input("testsrc2=size=1280x720:rate=1", f="lavfi").output(paths["thumb.jpg"], vframes=1).global_args(*quiet).run()
+    return paths
+
+class FakeYouTubeServer(object):
+    def __init__(self, media: T.Dict[str, str], bandwidth: float = 0.0, latency: float = 0.0, playlist_size: int = 1000):
+        # bandwidth is bytes/s per connection (0 for unlimited), latency in seconds before each response
+        self.media = media
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.playlist_size = playlist_size
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+        server = self
+        class Handler(FakeYouTubeHandler):
+            fake = server
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path: str = "") -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}{path}"
+
+    def start(self) -> "FakeYouTubeServer":
+        self.thread.start()
+        return self
+
+    def stop(self) -> T.NoReturn:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, nbytes: int) -> T.NoReturn:
+        with self._lock:
+            self.bytes_sent += nbytes
+
+class FakeYouTubeHandler(BaseHTTPRequestHandler):
+    fake: FakeYouTubeServer = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        with self.fake._lock:
+            self.fake.requests += 1
+        if self.fake.latency > 0:
+            time.sleep(self.fake.latency)
+        url = urlparse.urlparse(self.path)
+        params = {k: v[0] for k, v in urlparse.parse_qs(url.query).items()}
+        if url.path.endswith("/playlistItems"):
+            self.send_json(self.playlist_page(params))
+        elif url.path.endswith("/videos"):
+            self.send_json(self.videos(params))
+        elif url.path.startswith("/media/"):
+            self.send_media(url.path[len("/media/"):])
+        else:
+            self.send_error(404)
+
+    def send_json(self, body: T.Optional[T.Dict[str, T.Any]]):
+        if body is None:
+            self.send_error(404)
+            return
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def playlist_page(self, params):
+        if not params.get("playlistId", "").startswith("PL"):
+            return None
+        start = int(params.get("pageToken", 0))
+        count = int(params.get("maxResults", 5))
+        end = min(start + count, self.fake.playlist_size)
+        body = {"items": [{"contentDetails": {"videoId": fake_video_id(i)}} for i in range(start, end)]}
+        if end < self.fake.playlist_size:
+            body["nextPageToken"] = str(end)
+        return body
+
+    def videos(self, params):
+        items = []
+        for each_id in params.get("id", "").split(","):
+            if len(each_id) != 11:
+                continue
+            items.append({
+                "id": each_id,
+                "snippet": {
+                    "title": f"Benchmark video {video_number(each_id)}",
+                    "channelTitle": "Benchmarks",
+                    "thumbnails": {"high": {"url": self.fake.url("/media/thumb.jpg")}},
+                },
+                "contentDetails": {"duration": "PT30S"},
+            })
+        return {"items": items}
+
+    def send_media(self, name: str):
+        path = self.fake.media.get(name)
+        if path is None:
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        if match is not None:
+            start = int(match.group(1) or 0)
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+
+        chunk_size = 64 * 1024
+        started = time.perf_counter()
+        sent = 0
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                remaining -= len(chunk)
+                sent += len(chunk)
+                self.fake.count(len(chunk))
+                if self.fake.bandwidth > 0:
+                    # Sleep off however far ahead of the bandwidth we are
+                    ahead = sent / self.fake.bandwidth - (time.perf_counter() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+class FakeStream(object):
+    def __init__(self, url: str, extension: str, path: str):
+        self.url = url
+        self.extension = extension
+        self.path = path
+
+    def get_filesize(self) -> int:
+        return os.path.getsize(self.path)
+
+class FakeVideo(object):
+    def __init__(self, server: FakeYouTubeServer, video_id: str, audio_name: str):
+        self.server = server
+        self.videoid = video_id
+        self.title = f"Benchmark video {video_number(video_id)}"
+        self.author = "Benchmarks"
+        self.length = 30
+        self.audio_name = audio_name
+
+    def getbestthumb(self) -> str:
+        return self.server.url("/media/thumb.jpg")
+
+    def getbestaudio(self) -> FakeStream:
+        return FakeStream(self.server.url(f"/media/{self.audio_name}"), self.audio_name.split(".")[-1], self.server.media[self.audio_name])
+
+    def getbest(self) -> FakeStream:
+        return FakeStream(self.server.url("/media/video.mp4"), "mp4", self.server.media["video.mp4"])
+
+class FakePafy(object):
+    # Stands in for the pafy module (see dlmanager.load_pafy)
+    def __init__(self, server: FakeYouTubeServer, audio_name: str = "audio.webm"):
+        self.server = server
+        self.audio_name = audio_name
+
+    def set_api_key(self, key: str):
+        pass
+
+    def new(self, url: str, basic: bool = True) -> FakeVideo:
+        video_id = url[-11:]
+        if not all(c in VIDEO_ID_ALPHABET for c in video_id) or len(video_id) != 11:
+            raise ValueError(f"Not a video: {url}")
+        return FakeVideo(self.server, video_id, self.audio_name)
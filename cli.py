@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import typing as T
+
+from . import DEFAULT_DOWNLOAD_DIR
+from .dlmanager import DownloadEntry, extract_url_ids, iter_playlist_pages, videos_metadata
+from .scheduler import set_parallel_downloads, DEFAULT_PARALLEL_DOWNLOADS
+from .fetcher import SEGMENT_COUNT
+from .subtitlegetter import DEFAULT_SUBTITLE_LANGUAGES
+from .progresshub import progress_hub
+from .metacache import VideoMeta
+from .metrics import metrics
+
+# Runs the same pipeline as the GUI (resolve, download, subtitles, convert,
+# tag) without ever importing Kivy, and reports on stdout as JSON lines.
+
+_print_lock = threading.Lock()
+
+def emit(event: str, **fields) -> T.NoReturn:
+    line = json.dumps(dict(event=event, time=round(time.time(), 3), **fields))
+    with _print_lock:
+        print(line, flush=True)
+
+def read_targets_file(path: str) -> T.List[str]:
+    if path == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(path, "r") as f:
+            lines = f.readlines()
+    # Blank lines and # comments are skipped
+    return [l.strip() for l in lines if len(l.strip()) > 0 and not l.strip().startswith("#")]
+
+def expand_targets(targets: T.Iterable[str], on_invalid: T.Optional[T.Callable[[str], T.Any]] = None) -> T.Iterator[T.Tuple[str, T.Optional[VideoMeta]]]:
+    # Turns URLs, video IDs and playlist IDs into (video, metadata if known).
+    # Playlists are yielded page by page as they come in. Ones that turn out
+    # not to exist go to on_invalid.
+    for each_target in targets:
+        if each_target.startswith("http"):
+            video_id, list_id = extract_url_ids(each_target)
+        elif len(each_target) == 11:
+            video_id, list_id = each_target, None
+        else:
+            video_id, list_id = None, each_target
+
+        if list_id is not None and video_id is None:
+            found_any = False
+            for each_page in iter_playlist_pages(list_id):
+                found_any = True
+                metas = videos_metadata(each_page)
+                for each_video in each_page:
+                    yield each_video, metas.get(each_video)
+            if not found_any:
+                emit("error", target=each_target, message="Not a valid playlist")
+                if on_invalid is not None:
+                    on_invalid(each_target)
+        else:
+            yield each_target, None
+
+class BatchRun(object):
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.entries: T.List[DownloadEntry] = []
+        self.finished: T.Dict[str, bool] = {}
+        # Targets that didn't turn into anything to download
+        self.invalid: T.List[str] = []
+        self.all_done = threading.Condition()
+
+    def make_entry(self, url: str, meta: T.Optional[VideoMeta]) -> DownloadEntry:
+        entry = DownloadEntry()
+        entry.set_download_type(not self.args.video)
+        entry.set_download_subtitles(self.args.subtitles or self.args.burn_subtitles)
+        entry.set_burn_subtitles(self.args.burn_subtitles)
+        entry.subtitle_languages = self.args.sub_langs
+        entry.set_output_dir(self.args.output_dir)
+        entry.streaming = not self.args.no_stream
+        entry.segments = self.args.segments
+        entry.bind(done=lambda success, entry=entry: self.on_done(entry, success), resolved=lambda state, entry=entry: self.on_resolved(entry, state))
+        if meta is not None:
+            entry.set_meta(url, meta)
+        else:
+            # Looked up once we know it's not a duplicate
+            entry.url = url
+        return entry
+
+    def on_resolved(self, entry: DownloadEntry, state: str):
+        emit("resolve", id=entry.id, url=entry.url, state=state, title=entry.vtitle())
+
+    def on_done(self, entry: DownloadEntry, success: bool):
+        emit("done", id=entry.id, url=entry.url, success=success, path=entry.local_path() if success else None, conversion_path=entry.conversion_path)
+        with self.all_done:
+            self.finished[entry.id] = success
+            self.all_done.notify_all()
+
+    def report_progress(self):
+        # One line per running download every interval, no matter how many chunks came in
+        while True:
+            time.sleep(self.args.progress_interval)
+            changed = progress_hub.take_changed()
+            for each_entry in self.entries:
+                if each_entry.id not in changed or each_entry.id in self.finished:
+                    continue
+                progress = progress_hub.get(each_entry.id)
+                if progress is None or not progress.started:
+                    continue
+                emit("progress", id=each_entry.id, url=each_entry.url, fraction=round(progress.fraction(), 4), bytes=progress.done_bytes, total_bytes=progress.total_bytes, rate_kbps=round(progress.rate, 1), eta=round(progress.eta, 1))
+
+    def run(self, targets: T.Iterable[str]) -> int:
+        threading.Thread(target=self.report_progress, daemon=True).start()
+        queued = set()
+        for url, meta in expand_targets(targets, on_invalid=self.invalid.append):
+            entry = self.make_entry(url, meta)
+            if entry.video_id() is not None:
+                if entry.archive_key() in queued:
+                    emit("skipped", url=url, reason="duplicate")
+                    continue
+                queued.add(entry.archive_key())
+            self.entries.append(entry)
+            emit("queued", id=entry.id, url=url, title=entry.vtitle() if meta is not None else None)
+            if entry.check_archive():
+                # Downloaded on an earlier run, nothing to fetch
+                continue
+            if entry.meta is None:
+                entry.set_url_async(url)
+            # Downloads start right away, while any playlist is still being listed
+            entry.download()
+
+        with self.all_done:
+            while len(self.finished) < len(self.entries):
+                self.all_done.wait()
+
+        failed = len([s for s in self.finished.values() if not s])
+        emit("summary", total=len(self.entries), succeeded=len(self.entries) - failed, failed=failed, invalid=len(self.invalid))
+        return 0 if failed == 0 and len(self.invalid) == 0 else 1
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Download YouTube videos, audio and playlists without the GUI.")
+    parser.add_argument("targets", nargs="*", help="Video URLs/IDs or playlist URLs/IDs")
+    parser.add_argument("-f", "--file", action="append", default=[], help="Read more targets from a file, one per line (- for stdin)")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_PARALLEL_DOWNLOADS, help="Downloads to run at once")
+    parser.add_argument("-o", "--output-dir", default=None, help="Where to put the downloads")
+    parser.add_argument("--video", action="store_true", help="Download video instead of just the audio")
+    parser.add_argument("--subtitles", action="store_true", help="Download subtitles too")
+    parser.add_argument("--burn-subtitles", action="store_true", help="Burn the subtitles into the video")
+    parser.add_argument("--sub-langs", type=lambda s: [l.strip() for l in s.split(",") if l.strip()], default=list(DEFAULT_SUBTITLE_LANGUAGES), help="Comma separated subtitle languages, the first one gets burned in")
+    parser.add_argument("--no-stream", action="store_true", help="Download to a file first instead of piping into ffmpeg")
+    parser.add_argument("--segments", type=int, default=SEGMENT_COUNT, help="Connections per large download (1 turns it off)")
+    parser.add_argument("--progress-interval", type=float, default=1.0, help="Seconds between progress lines")
+    parser.add_argument("--trace", default=None, help="Append a JSON line per finished download, with how long each stage took")
+    parser.add_argument("--metrics-file", default=None, help="Keep Prometheus-style metrics in this file")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus-style metrics on this port at /metrics")
+    return parser
+
+def main(argv: T.Optional[T.List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.burn_subtitles:
+        args.video = True
+
+    targets = list(args.targets)
+    for each_file in args.file:
+        targets.extend(read_targets_file(each_file))
+    if len(targets) == 0:
+        emit("error", message="Nothing to download")
+        return 2
+
+    # Otherwise every download fails when it opens its .part file
+    os.makedirs(args.output_dir if args.output_dir is not None else DEFAULT_DOWNLOAD_DIR, exist_ok=True)
+    set_parallel_downloads(args.jobs)
+    metrics.configure(trace_path=args.trace, prometheus_path=args.metrics_file)
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
+    return BatchRun(args).run(targets)
+
+if __name__ == '__main__':
+    sys.exit(main())
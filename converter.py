@@ -1,22 +1,267 @@
 import os
-import ffmpeg
 
 import typing as T
 import sys
 
-def extract_audio(input_file: str, burned_subtitles : T.Optional[str] = None, remove_old: bool = False) -> T.Optional[str]:
-    return convert_common(input_file, ".mp3", True, burned_subtitles, remove_old)
+from .scheduler import ffmpeg_threads
+from .fetcher import part_path_for
 
-def convert_video(input_file: str, burned_subtitles : T.Optional[str] = None, remove_old: bool = False) -> T.Optional[str]:
-    return convert_common(input_file, ".mp4", False, burned_subtitles, remove_old)
+# Which way a conversion went, reported back through the `report` callbacks
+class ConversionPath(object):
+    # Already in the right format, nothing was run
+    NONE = "none"
+    # Streams copied into the new container as they are
+    REMUX = "remux"
+    # Decoded and re-encoded
+    TRANSCODE = "transcode"
 
-def convert_common(input_file: str, desired_ending: str, audio_only: bool, burned_subtitles: T.Optional[str], remove_old: bool = False) -> T.Optional[str]:
+ReportCallback = T.Callable[[str], T.Any]
+
+# Codecs each output container can hold without re-encoding
+CONTAINER_CODECS = {
+    ".mp4": {
+        "video": {"h264", "hevc", "av1", "mpeg4"},
+        "audio": {"aac", "mp3", "alac"},
+    },
+    ".m4a": {
+        "audio": {"aac", "alac"},
+    },
+    ".mp3": {
+        "audio": {"mp3"},
+    },
+}
+
+# Containers that can carry a picture as cover art
+COVER_ART_CONTAINERS = {".mp3", ".m4a"}
+
+def extract_audio(input_file: str, burned_subtitles : T.Optional[str] = None, remove_old: bool = False, report: T.Optional[ReportCallback] = None, metadata: T.Optional[T.Dict[str, str]] = None, cover_art: T.Optional[str] = None) -> T.Optional[str]:
+    return convert_common(input_file, ".mp3", True, burned_subtitles, remove_old, report, metadata, cover_art)
+
+def convert_video(input_file: str, burned_subtitles : T.Optional[str] = None, remove_old: bool = False, report: T.Optional[ReportCallback] = None, metadata: T.Optional[T.Dict[str, str]] = None, cover_art: T.Optional[str] = None) -> T.Optional[str]:
+    return convert_common(input_file, ".mp4", False, burned_subtitles, remove_old, report, metadata, cover_art)
+
+def extract_audio_stream(chunks: T.Iterable[bytes], output_path: str, input_ext: T.Optional[str] = None, burned_subtitles: T.Optional[str] = None, probe_source: T.Optional[str] = None, report: T.Optional[ReportCallback] = None, metadata: T.Optional[T.Dict[str, str]] = None, cover_art: T.Optional[str] = None) -> T.Optional[str]:
+    return convert_stream(chunks, output_path, ".mp3", True, burned_subtitles, input_ext, probe_source, report, metadata, cover_art)
+
+def convert_video_stream(chunks: T.Iterable[bytes], output_path: str, input_ext: T.Optional[str] = None, burned_subtitles: T.Optional[str] = None, probe_source: T.Optional[str] = None, report: T.Optional[ReportCallback] = None, metadata: T.Optional[T.Dict[str, str]] = None, cover_art: T.Optional[str] = None) -> T.Optional[str]:
+    return convert_stream(chunks, output_path, ".mp4", False, burned_subtitles, input_ext, probe_source, report, metadata, cover_art)
+
+def _ffmpeg():
+    # Imported on first use, nothing needs it until something gets converted
+    import ffmpeg
+    return ffmpeg
+
+def probe_codecs(source: str) -> T.Optional[T.Dict[str, T.List[str]]]:
+    # Returns {"video": [...], "audio": [...]} codec names, or None if we can't tell.
+    # Works on local files as well as URLs.
+    try:
+        info = _ffmpeg().probe(source)
+    except Exception as err:
+        print(f"WARNING: Could not probe {source}: {err}", file=sys.stderr)
+        return None
+    codecs = {"video": [], "audio": []}
+    for each_stream in info.get("streams", []):
+        codec_type = each_stream.get("codec_type")
+        if codec_type in codecs:
+            # Cover art shows up as a video stream, but it's not really one
+            if each_stream.get("disposition", {}).get("attached_pic", 0):
+                continue
+            codecs[codec_type].append(each_stream.get("codec_name"))
+    return codecs
+
+def can_remux(codecs: T.Optional[T.Dict[str, T.List[str]]], desired_ending: str, audio_only: bool) -> bool:
+    if codecs is None:
+        return False
+    allowed = CONTAINER_CODECS.get(desired_ending.lower())
+    if allowed is None:
+        return False
+
+    wanted_types = ["audio"] if audio_only else ["video", "audio"]
+    for codec_type in wanted_types:
+        if len(codecs[codec_type]) == 0 and codec_type == "audio":
+            # Nothing to carry over
+            return False
+        for codec_name in codecs[codec_type]:
+            if codec_name not in allowed.get(codec_type, set()):
+                return False
+    return True
+
+def _report(report: T.Optional[ReportCallback], path: str, output_path: str):
+    print(f"Conversion path for {os.path.basename(output_path)}: {path}", file=sys.stderr)
+    if report is not None:
+        report(path)
+
+def can_copy_audio(codecs: T.Optional[T.Dict[str, T.List[str]]], desired_ending: str) -> bool:
+    # Whether the audio can go into the container as it is, even if the video can't
+    if codecs is None or len(codecs["audio"]) == 0:
+        return False
+    allowed = CONTAINER_CODECS.get(desired_ending.lower(), {}).get("audio", set())
+    return all(codec_name in allowed for codec_name in codecs["audio"])
+
+# Tags ffmpeg can't put where tagger does, so they're left to it after the
+# conversion: the id3 muxer writes comments as TXXX:comment rather than COMM,
+# and the mp4 muxer drops keys it doesn't know (use_metadata_tags would keep
+# them, but as mdta keys in place of the usual atoms, titles included).
+TAGGER_ONLY_KEYS = {
+    ".mp3": {"comment"},
+    ".m4a": {"video_id"},
+    ".mp4": {"video_id"},
+}
+# Bytes left free in the tag header of those containers
+METADATA_HEADER_PADDING = 1024
+
+def _tag_args(output_path: str, metadata: T.Optional[T.Dict[str, str]]) -> T.Dict[str, str]:
+    # ffmpeg options that write the tags while converting, so the file doesn't
+    # need opening and rewriting again afterwards. ffmpeg reads
+    # -metadata:g:<n> the same as -metadata, which lets each one have its own key here.
+    # The input's own container tags (major_brand and the like) are dropped.
+    args = {"map_metadata": "-1"}
+    if metadata is not None:
+        skipped = TAGGER_ONLY_KEYS.get(os.path.splitext(output_path)[1].lower(), set())
+        tags = [(k, v) for k, v in sorted(metadata.items()) if v is not None and k not in skipped]
+        for i, (key, value) in enumerate(tags):
+            args[f"metadata:g:{i}"] = f"{key}={value}"
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext == ".mp3":
+        # What most players read
+        args["id3v2_version"] = "3"
+    if ext in TAGGER_ONLY_KEYS:
+        # Room for _tag_leftovers, so saving them doesn't rewrite the whole file
+        args["metadata_header_padding"] = str(METADATA_HEADER_PADDING)
+    return args
+
+def _tag_leftovers(output_path: str, metadata: T.Optional[T.Dict[str, str]]) -> T.NoReturn:
+    # Whatever _tag_args left out, written the same way tagger does it
+    if metadata is None:
+        return
+    leftovers = {k: metadata.get(k) for k in TAGGER_ONLY_KEYS.get(os.path.splitext(output_path)[1].lower(), set())}
+    if all(v is None for v in leftovers.values()):
+        return
+    from .tagger import tag_file
+    try:
+        tag_file(output_path, source_url=leftovers.get("comment"), video_id=leftovers.get("video_id"))
+    except Exception as err:
+        print(f"WARNING: Couldn't tag {output_path}: {err}", file=sys.stderr)
+
+def _audio_output(strm_audio, output_path: str, cover_art: T.Optional[str], **kwargs):
+    # The audio, plus the cover art as an attached picture if the container takes one
+    ext = os.path.splitext(output_path)[1].lower()
+    if cover_art is None or ext not in COVER_ART_CONTAINERS:
+        return strm_audio.output(output_path, **kwargs)
+    strm_cover = _ffmpeg().input(cover_art).video
+    return _ffmpeg().output(strm_audio, strm_cover, output_path, **{"c:v": "copy", "disposition:v": "attached_pic"}, **kwargs)
+
+def _build_output(strm_input, output_path: str, audio_only: bool, burned_subtitles: T.Optional[str], remux: bool = False, copy_audio: bool = False, metadata: T.Optional[T.Dict[str, str]] = None, cover_art: T.Optional[str] = None):
+    tag_args = _tag_args(output_path, metadata)
+    if remux:
+        # Codecs already fit the container, just copy the streams over
+        if audio_only:
+            strm_output = _audio_output(strm_input.audio, output_path, cover_art, acodec="copy", **tag_args)
+        else:
+            strm_output = strm_input.output(output_path, c="copy", **tag_args)
+        return strm_output.global_args("-y", "-loglevel", "warning")
+
+    if audio_only:
+        # We just want the audio
+        strm_output = _audio_output(strm_input.audio, output_path, cover_art, threads=ffmpeg_threads(), **tag_args)
+        return strm_output.global_args("-y", "-loglevel", "warning")
+    else:
+        # We want both audio and video!
+        if burned_subtitles is None:
+            # No subtitles. Just take it as is
+            strm_final = strm_input
+        else:
+            # We want to pass the video through a burning-stage
+            subtitle_relpath = os.path.relpath(burned_subtitles)
+
+            # Burn subtitles into the video
+            strm_subbed = strm_input.video.filter("subtitles", subtitle_relpath)
+
+            # Only the video has to go through the filter. The audio is mapped
+            # straight across, and copied as it is if the container takes it.
+            audio_args = {"acodec": "copy"} if copy_audio else {}
+            strm_output = _ffmpeg().output(strm_subbed, strm_input.audio, output_path, threads=ffmpeg_threads(), **audio_args, **tag_args)
+            return strm_output.global_args("-y", "-loglevel", "warning")
+
+    # Make the output pin. Encoders stick to their share of the cores.
+    strm_output = strm_final.output(output_path, threads=ffmpeg_threads(), **tag_args)
+
+    # Now we have the output pin  / compute graph
+    # Add program-level args
+    ffmpeg_globals = [
+        # Overwrite files as needed
+        "-y",
+        # Print only warnings and errors
+        "-loglevel",
+        "warning"
+    ]
+
+    # Apply globals
+    return strm_output.global_args(*ffmpeg_globals)
+
+def _check_subtitles(burned_subtitles: T.Optional[str]) -> T.Optional[str]:
     if burned_subtitles is not None:
         burned_subtitles = os.path.abspath(burned_subtitles)
         if not os.path.isfile(burned_subtitles):
             # No subtitles!
             print(f"WARNING: Subtitles {burned_subtitles} not found. Skipping.", file=sys.stderr)
-            burned_subtitles = None    
+            burned_subtitles = None
+    return burned_subtitles
+
+def convert_stream(chunks: T.Iterable[bytes], output_path: str, desired_ending: str, audio_only: bool, burned_subtitles: T.Optional[str], input_ext: T.Optional[str] = None, probe_source: T.Optional[str] = None, report: T.Optional[ReportCallback] = None, metadata: T.Optional[T.Dict[str, str]] = None, cover_art: T.Optional[str] = None) -> T.Optional[str]:
+    # Same as convert_common, except the input bytes are piped into ffmpeg as
+    # they arrive instead of being read back from a finished download.
+    burned_subtitles = _check_subtitles(burned_subtitles)
+    output_path = f"{os.path.splitext(os.path.abspath(output_path))[0]}{desired_ending}"
+
+    if input_ext is not None and input_ext.lower() == desired_ending.lower() and (burned_subtitles is None):
+        # Nothing to convert, the bytes can go straight to disk
+        working_path = part_path_for(output_path)
+        try:
+            with open(working_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(working_path, output_path)
+        except Exception as err:
+            print(f"Download Error: {err}", file=sys.stderr)
+            if os.path.exists(working_path):
+                os.remove(working_path)
+            return None
+        _report(report, ConversionPath.NONE, output_path)
+        return output_path
+
+    # Can't probe a pipe, but the source URL works just as well
+    codecs = probe_codecs(probe_source) if probe_source is not None else None
+    remux = burned_subtitles is None and can_remux(codecs, desired_ending, audio_only)
+    copy_audio = burned_subtitles is not None and can_copy_audio(codecs, desired_ending)
+
+    working_path = part_path_for(output_path)
+    process = None
+    try:
+        strm_input = _ffmpeg().input("pipe:")
+        strm_output = _build_output(strm_input, working_path, audio_only, burned_subtitles, remux, copy_audio, metadata, cover_art)
+        process = strm_output.run_async(pipe_stdin=True)
+        for chunk in chunks:
+            process.stdin.write(chunk)
+        process.stdin.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {process.returncode}")
+        os.replace(working_path, output_path)
+        _tag_leftovers(output_path, metadata)
+    except Exception as err:
+        print(f"Conversion Error: {err}", file=sys.stderr)
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+        if os.path.exists(working_path):
+            os.remove(working_path)
+        return None
+    else:
+        _report(report, ConversionPath.REMUX if remux else ConversionPath.TRANSCODE, output_path)
+        return output_path
+
+def convert_common(input_file: str, desired_ending: str, audio_only: bool, burned_subtitles: T.Optional[str], remove_old: bool = False, report: T.Optional[ReportCallback] = None, metadata: T.Optional[T.Dict[str, str]] = None, cover_art: T.Optional[str] = None) -> T.Optional[str]:
+    burned_subtitles = _check_subtitles(burned_subtitles)
 
     input_file = os.path.abspath(input_file)
     if not os.path.isfile(input_file):
@@ -28,8 +273,16 @@ def convert_common(input_file: str, desired_ending: str, audio_only: bool, burne
 
     if input_ext.lower() == desired_ending.lower() and (burned_subtitles is None):
         # We don't need to copy it
+        _report(report, ConversionPath.NONE, output_path)
         return output_path
 
+    # Subtitles have to be burned into freshly encoded video, otherwise
+    # see if the streams can just be copied into the new container. The
+    # audio alone might still be copyable when burning.
+    codecs = probe_codecs(input_file)
+    remux = burned_subtitles is None and can_remux(codecs, desired_ending, audio_only)
+    copy_audio = burned_subtitles is not None and can_copy_audio(codecs, desired_ending)
+
     # There's something we need to do with it!
     # We'll use FFMPEG for all conversion
 
@@ -43,61 +296,28 @@ def convert_common(input_file: str, desired_ending: str, audio_only: bool, burne
 
     # Paths are good now
 
+    working_path = part_path_for(output_path)
+
     # Catch any exceptions made during conversion
     try:        
         # Get the input stream
-        strm_input = ffmpeg.input(input_file)
-
-        if audio_only:
-            # We just want the audio
-            strm_final = strm_input.audio
-        else:
-            # We want both audio and video!
-            if burned_subtitles is None:
-                # No subtitles. Just take it as is
-                strm_final = strm_input
-            else:
-                # We want to pass the video through a burning-stage
-                subtitle_relpath = os.path.relpath(burned_subtitles)
-
-                # Extract video/ audio
-                strm_video = strm_input.video
-                strm_audio = strm_input.audio
-
-                # Burn subtitles into the video
-                strm_subbed = strm_video.filter("subtitles", subtitle_relpath)
-
-                # Combined the burned video back with the audio
-                strm_final = ffmpeg.concat(strm_subbed, strm_audio, v=1, a=1)
-        
-        # Make the output pin
-        strm_output = strm_final.output(output_path)
-
-        # Now we have the output pin  / compute graph
-        # Add program-level args
-        ffmpeg_globals = [
-            # Overwrite files as needed
-            "-y",
-            # Print only warnings and errors
-            "-loglevel",
-            "warning"
-        ]
-
-
-        # Apply globals
-        strm_output = strm_output.global_args(*ffmpeg_globals)
+        strm_input = _ffmpeg().input(input_file)
+        strm_output = _build_output(strm_input, working_path, audio_only, burned_subtitles, remux, copy_audio, metadata, cover_art)
 
         # Now, run FFMPEG conversion!
         strm_output.run()
+        os.replace(working_path, output_path)
+        _tag_leftovers(output_path, metadata)
     except Exception as err:
         print(f"Conversion Error: {err}", file=sys.stderr)
-        if os.path.exists(output_path):
-            os.remove(output_path)
+        if os.path.exists(working_path):
+            os.remove(working_path)
         return None
     else:
         # Conversion success!
         if remove_old and input_fn.lower() != output_fn.lower():
             os.remove(input_file)
+        _report(report, ConversionPath.REMUX if remux else ConversionPath.TRANSCODE, output_path)
         return output_path
 
         
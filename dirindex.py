@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+
+import typing as T
+
+from .scheduler import background_scheduler
+
+# How long a directory listing is trusted before its mtime gets checked again
+RESCAN_INTERVAL = 2.0
+
+class DirectoryListing(object):
+    def __init__(self, names: T.Set[str], mtime: float, checked_at: float):
+        self.names = names
+        self.mtime = mtime
+        self.checked_at = checked_at
+        # Set while a fresh listing is being made in the background, along
+        # with what got noted in the meantime (name -> whether it's there now)
+        self.rescanning = False
+        self.noted: T.Dict[str, bool] = {}
+
+class DirectoryIndex(object):
+    # Which files are in each download directory, so asking whether a download
+    # is already there is a set lookup instead of a stat per queue row.
+    # A directory gets listed the first time it's asked about. After that its
+    # mtime is checked at most every RESCAN_INTERVAL, and it's only listed
+    # again if that changed. That happens on the background scheduler, since
+    # downloads keep touching the directory, and the old listing is used until
+    # it's done. Files we write ourselves get noted right away.
+    def __init__(self, rescan_interval: float = RESCAN_INTERVAL):
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        self._listings: T.Dict[str, DirectoryListing] = {}
+
+    def _scan(self, directory: str) -> T.Tuple[T.Set[str], float]:
+        try:
+            mtime = os.stat(directory).st_mtime
+            with os.scandir(directory) as entries:
+                names = set(e.name for e in entries if e.is_file())
+        except OSError:
+            # Not there (yet), so nothing's in it
+            return set(), -1.0
+        return names, mtime
+
+    def _listing(self, directory: str) -> DirectoryListing:
+        now = time.monotonic()
+        with self._lock:
+            listing = self._listings.get(directory)
+            if listing is not None and (listing.rescanning or now - listing.checked_at < self.rescan_interval):
+                return listing
+        if listing is None:
+            # Nothing to go on yet, so this one has to wait for it
+            names, mtime = self._scan(directory)
+            listing = DirectoryListing(names, mtime, now)
+            with self._lock:
+                self._listings[directory] = listing
+            return listing
+
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            mtime = -1.0
+        with self._lock:
+            if mtime == listing.mtime:
+                listing.checked_at = now
+                return listing
+            if listing.rescanning:
+                return listing
+            listing.rescanning = True
+            listing.noted = {}
+        background_scheduler.submit(lambda: self._rescan(directory, listing), name=f"rescan {directory}")
+        return listing
+
+    def _rescan(self, directory: str, old_listing: DirectoryListing) -> T.NoReturn:
+        try:
+            names, mtime = self._scan(directory)
+            with self._lock:
+                # The scan might have started before some of these happened
+                for name, present in old_listing.noted.items():
+                    if present:
+                        names.add(name)
+                    else:
+                        names.discard(name)
+                if self._listings.get(directory) is old_listing:
+                    self._listings[directory] = DirectoryListing(names, mtime, time.monotonic())
+        finally:
+            with self._lock:
+                old_listing.rescanning = False
+                old_listing.noted = {}
+
+    def exists(self, path: str) -> bool:
+        directory, name = os.path.split(os.path.abspath(path))
+        return name in self._listing(directory).names
+
+    def note_added(self, path: str) -> T.NoReturn:
+        directory, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            listing = self._listings.get(directory)
+            if listing is not None:
+                listing.names.add(name)
+                if listing.rescanning:
+                    listing.noted[name] = True
+
+    def note_removed(self, path: str) -> T.NoReturn:
+        directory, name = os.path.split(os.path.abspath(path))
+        with self._lock:
+            listing = self._listings.get(directory)
+            if listing is not None:
+                listing.names.discard(name)
+                if listing.rescanning:
+                    listing.noted[name] = False
+
+    def invalidate(self, directory: T.Optional[str] = None) -> T.NoReturn:
+        # Forget one directory (or all of them), they'll be listed again when next asked about
+        with self._lock:
+            if directory is None:
+                self._listings = {}
+            else:
+                self._listings.pop(os.path.abspath(directory), None)
+
+output_index = DirectoryIndex()
@@ -1,22 +1,31 @@
 import typing as T
 
 from . import DEFAULT_DOWNLOAD_DIR
-from .subtitlegetter import download_subtitles
-from .dlmutex import downloading_lock
+from .subtitlegetter import download_subtitles, DEFAULT_SUBTITLE_LANGUAGES
+from .scheduler import download_scheduler, background_scheduler, conversion_scheduler, conversion_slots, Job, JobState
 
-import pafy
-import youtube_dl
 import uuid
-import requests
+import threading
 
 import os
-import threading
+import sys
 
-from .converter import extract_audio, convert_video
+from .converter import extract_audio, convert_video, extract_audio_stream, convert_video_stream, ConversionPath
+from .fetcher import iter_url_chunks, resumable_download, segmented_download, has_partial, SEGMENT_COUNT
 from .api_key import YOUTUBE_API_KEY
 from .tagger import tag_file
+from .thumbcache import thumbnail_cache
+from .metacache import metadata_cache, VideoMeta, CachedStream
+from .progresshub import progress_hub
+from .dirindex import output_index
+from .archive import download_archive, ArchivedDownload
+from .metrics import metrics, StageTimer
 
 import urllib.parse as urlparse
+import re
+
+if T.TYPE_CHECKING:
+    import requests
 
 PLACEHOLDER_IMG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "placeholder.png")
 
@@ -27,72 +36,220 @@ def extract_url_ids(url: str) -> T.Tuple[T.Optional[str], T.Optional[str]]:
     list_id = args.get("list", [None])[0]
     return video_id, list_id
 
-def playlist_items(playlist_id_or_url: str) -> T.Optional[T.List[str]]:
+def extract_video_id(url: str) -> T.Optional[str]:
+    url = url.strip()
+    if not url.startswith("http") and len(url) == 11:
+        # Already a bare ID
+        return url
+    video_id, _ = extract_url_ids(url)
+    if video_id is None and "youtu.be/" in url:
+        video_id = urlparse.urlparse(url).path.strip("/").split("/")[0]
+    if video_id is not None and len(video_id) != 11:
+        return None
+    return video_id
+
+# Where the YouTube Data API lives
+DATA_API_URL = "https://youtube.googleapis.com/youtube/v3"
+# Largest page the Data API will hand back
+PLAYLIST_PAGE_SIZE = 50
+
+_api_session: T.Optional["requests.Session"] = None
+
+def api_session() -> "requests.Session":
+    # One keep-alive session shared by every Data API call
+    global _api_session
+    if _api_session is None:
+        import requests
+        _api_session = requests.Session()
+    return _api_session
+
+_pafy_module = None
+
+def load_pafy():
+    # pafy pulls in youtube_dl, which is by far the slowest thing to import,
+    # so it only gets loaded (and handed the API key) once something needs it
+    global _pafy_module
+    if _pafy_module is None:
+        import pafy
+        pafy.set_api_key(YOUTUBE_API_KEY)
+        _pafy_module = pafy
+    return _pafy_module
+
+def extract_list_id(playlist_id_or_url: str) -> T.Optional[str]:
     if playlist_id_or_url.startswith("http"):
         _, list_id = extract_url_ids(playlist_id_or_url)
+        return list_id
     else:
-        list_id = playlist_id_or_url
-    
+        return playlist_id_or_url
+
+def iter_playlist_pages(playlist_id_or_url: str) -> T.Iterator[T.List[str]]:
+    # Yields the video IDs one page at a time, as soon as each page arrives.
+    # Yields nothing at all if it's not a valid playlist.
+    list_id = extract_list_id(playlist_id_or_url)
     if list_id is None:
-        return None
-    else:
-        base_url = "https://youtube.googleapis.com/youtube/v3/playlistItems"
-        api_url = f"{base_url}?part=id,contentDetails&maxResults=25&playlistId={list_id}&key={YOUTUBE_API_KEY}"
-        response = requests.get(api_url)
-        has_pages = True
-        found_items = None
-        while has_pages:
-            if response.ok:
-                # Valid playlist
-                response_body = response.json()
-
-                # Initialize list
-                if found_items is None:
-                    found_items = []
-                
-                listed_ids = [each_item.get("contentDetails", {}).get("videoId", None) for each_item in response_body["items"]]
-                listed_ids = [i for i in listed_ids if i is not None]
-                found_items.extend(listed_ids)
-                
-                # Get more pages as needed
-                if "nextPageToken" in response_body:
-                    nextTok = response_body["nextPageToken"]
-                    response = requests.get(f"{api_url}&pageToken={nextTok}")
-                    has_pages = True
-                else:
-                    has_pages = False
-                
-            else:
-                # Not a valid playlist
-                has_pages = False
-        
-        # Now we've got everything
-        return found_items
+        return
+
+    base_url = f"{DATA_API_URL}/playlistItems"
+    params = {
+        "part": "id,contentDetails",
+        "maxResults": PLAYLIST_PAGE_SIZE,
+        "playlistId": list_id,
+        "key": YOUTUBE_API_KEY,
+    }
+    session = api_session()
+    while True:
+        response = session.get(base_url, params=params)
+        if not response.ok:
+            # Not a valid playlist
+            return
+
+        response_body = response.json()
+        listed_ids = [each_item.get("contentDetails", {}).get("videoId", None) for each_item in response_body.get("items", [])]
+        yield [i for i in listed_ids if i is not None]
+
+        # Get more pages as needed
+        if "nextPageToken" in response_body:
+            params["pageToken"] = response_body["nextPageToken"]
+        else:
+            return
+
+def iter_playlist_items(playlist_id_or_url: str) -> T.Iterator[str]:
+    for each_page in iter_playlist_pages(playlist_id_or_url):
+        yield from each_page
+
+def playlist_items(playlist_id_or_url: str) -> T.Optional[T.List[str]]:
+    found_items = None
+    for each_page in iter_playlist_pages(playlist_id_or_url):
+        # Initialize list
+        if found_items is None:
+            found_items = []
+        found_items.extend(each_page)
+
+    # Now we've got everything
+    return found_items
+
+# The videos endpoint takes at most this many IDs per request
+VIDEOS_BATCH_SIZE = 50
+
+def parse_iso_duration(duration: str) -> int:
+    # The Data API gives durations like PT1H2M3S
+    match = re.match(r"P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?", duration or "")
+    if match is None:
+        return 0
+    days, hours, minutes, seconds = [int(g) if g is not None else 0 for g in match.groups()]
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+def _best_api_thumbnail(thumbnails: T.Dict[str, T.Any]) -> T.Optional[str]:
+    for each_size in ["maxres", "standard", "high", "medium", "default"]:
+        if each_size in thumbnails:
+            return thumbnails[each_size].get("url")
+    return None
+
+def videos_metadata(video_ids: T.Sequence[str]) -> T.Dict[str, VideoMeta]:
+    # Looks up title/author/duration/thumbnail for a bunch of videos, 50 per
+    # API call, instead of scraping each one with pafy. Videos that don't come
+    # back (private, deleted...) are just missing from the result.
+    resolved = metadata_cache.get_many(video_ids)
+    missing = [i for i in video_ids if i not in resolved]
+
+    base_url = f"{DATA_API_URL}/videos"
+    session = api_session()
+    fetched = []
+    for start in range(0, len(missing), VIDEOS_BATCH_SIZE):
+        batch = missing[start:start + VIDEOS_BATCH_SIZE]
+        params = {
+            "part": "snippet,contentDetails",
+            "id": ",".join(batch),
+            "maxResults": VIDEOS_BATCH_SIZE,
+            "key": YOUTUBE_API_KEY,
+        }
+        response = session.get(base_url, params=params)
+        if not response.ok:
+            print(f"WARNING: Video lookup failed ({response.status_code})", file=sys.stderr)
+            continue
+        for each_item in response.json().get("items", []):
+            snippet = each_item.get("snippet", {})
+            meta = VideoMeta(
+                each_item["id"],
+                snippet.get("title", ""),
+                snippet.get("channelTitle", ""),
+                parse_iso_duration(each_item.get("contentDetails", {}).get("duration", "")),
+                _best_api_thumbnail(snippet.get("thumbnails", {}))
+            )
+            resolved[meta.video_id] = meta
+            fetched.append(meta)
+
+    if len(fetched) > 0:
+        metadata_cache.put_many(fetched)
+    return resolved
+
+# Streams at least this big get downloaded over several connections
+SEGMENTED_MIN_SIZE = 32 * 1024 * 1024
+
+# Changing any of these changes where the download ends up
+OUTPUT_PATH_FIELDS = ("url", "meta", "title", "author", "audio_only", "output_dir", "output_file", "output_extension")
 
 def filenamify(s):
     good_chars = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ.-_0123456789'
     return "".join([c for c in s if c in good_chars])
 
+class ResolveState(object):
+    # No URL set
+    IDLE = "idle"
+    # Looking the URL up in the background
+    RESOLVING = "resolving"
+    RESOLVED = "resolved"
+    # Not a valid / real video
+    FAILED = "failed"
+
 class DownloadEntry(object):
     def __init__(self):
         self.id = str(uuid.uuid4())
+        # Guards state that the UI thread and the workers both fill in
+        self._lock = threading.Lock()
         
         # Youtube information
         self.url = None
         self.pafy = None
+        # Title, author etc. Either from the metadata cache or a pafy lookup.
+        # The pafy object itself is only needed once we actually download.
+        self.meta: T.Optional[VideoMeta] = None
+        self.resolve_state = ResolveState.IDLE
+        self.resolve_job: T.Optional[Job] = None
         self.audio_only = False
         self.subtitles = False
         self.burn_subtitles = False
+        # All of these get downloaded, the first one is what gets burned in
+        self.subtitle_languages = list(DEFAULT_SUBTITLE_LANGUAGES)
+        # Fetches the subtitles alongside the media, see _start_subtitles
+        self.subtitles_job: T.Optional[Job] = None
         self.download_progress = None
-        self.download_thread = None
+        self.download_job: T.Optional[Job] = None
+        # The ffmpeg run on a finished download, once it's been handed off
+        self.conversion_job: T.Optional[Job] = None
+
+        # Pipe the download straight into ffmpeg instead of going through a temp file
+        self.streaming = True
+        # Which converter.ConversionPath the last download took
+        self.conversion_path = None
+        # Parallel connections for big streams. 1 turns segmenting off.
+        self.segments = SEGMENT_COUNT
 
         self.progress_listeners = []
         self.done_listeners = []
+        self.resolve_listeners = []
+        # Called with (entry, names of the fields that changed)
+        self.changed_listeners = []
 
         # Local information
         self.output_dir = None
         self.output_file = None
         self.output_extension = None
+        # opath(), worked out once and forgotten whenever one of OUTPUT_PATH_FIELDS changes
+        self._opath: T.Optional[str] = None
+        # Goes up every time _opath is forgotten, so a path worked out from
+        # fields that changed halfway through never gets cached
+        self._opath_version = 0
 
         # Tag information
         self.title = None
@@ -100,58 +257,226 @@ class DownloadEntry(object):
 
         self.editable = True
         self.is_done = False
+        # None until a download finishes, then whether it worked
+        self.success: T.Optional[bool] = None
     
-    def bind(self, progress: T.Optional[T.Callable[[float], T.NoReturn]] = None, done: T.Optional[T.Callable[[bool], T.NoReturn]] = None):
+    def bind(self, progress: T.Optional[T.Callable[[float], T.NoReturn]] = None, done: T.Optional[T.Callable[[bool], T.NoReturn]] = None, resolved: T.Optional[T.Callable[[str], T.NoReturn]] = None, changed: T.Optional[T.Callable[["DownloadEntry", T.Tuple[str, ...]], T.NoReturn]] = None):
         if progress is not None:
             self.progress_listeners.append(progress)
         if done is not None:
             self.done_listeners.append(done)    
+        if resolved is not None:
+            self.resolve_listeners.append(resolved)
+        if changed is not None:
+            self.changed_listeners.append(changed)
+
+    def to_record(self) -> T.Dict[str, T.Any]:
+        # Everything needed to bring this entry back after a restart
+        meta = self.meta
+        return {
+            "id": self.id,
+            "url": self.url,
+            "video_id": meta.video_id if meta is not None else None,
+            "v_title": meta.title if meta is not None else None,
+            "v_author": meta.author if meta is not None else None,
+            "v_duration": meta.duration if meta is not None else None,
+            "v_thumbnail": meta.thumbnail if meta is not None else None,
+            "audio_only": self.audio_only,
+            "subtitles": self.subtitles,
+            "burn_subtitles": self.burn_subtitles,
+            "title": self.title,
+            "author": self.author,
+            "output_dir": self.output_dir,
+            "output_file": self.output_file,
+            "output_extension": self.output_extension,
+            "is_done": self.is_done,
+            "success": self.success,
+            "conversion_path": self.conversion_path,
+        }
+
+    @classmethod
+    def from_record(cls, record: T.Dict[str, T.Any]) -> "DownloadEntry":
+        entry = cls()
+        entry.id = record["id"]
+        entry.url = record["url"]
+        if record["video_id"] is not None:
+            # Already resolved once, no need to look it up again
+            entry.meta = VideoMeta(record["video_id"], record["v_title"], record["v_author"], record["v_duration"], record["v_thumbnail"])
+            entry.resolve_state = ResolveState.RESOLVED
+        entry.audio_only = bool(record["audio_only"])
+        entry.subtitles = bool(record["subtitles"])
+        entry.burn_subtitles = bool(record["burn_subtitles"])
+        entry.title = record["title"]
+        entry.author = record["author"]
+        entry.output_dir = record["output_dir"]
+        entry.output_file = record["output_file"]
+        entry.output_extension = record["output_extension"]
+        entry.success = None if record["success"] is None else bool(record["success"])
+        # Anything that was still going when we shut down just goes back in
+        # the queue. It'll pick up its .part file when it gets downloaded again.
+        entry.is_done = bool(record["is_done"]) and entry.success is not None
+        entry.editable = not entry.is_done
+        entry.conversion_path = record["conversion_path"]
+        return entry
+
+    def _notify_changed(self, *fields: str):
+        if any(f in OUTPUT_PATH_FIELDS for f in fields):
+            with self._lock:
+                self._opath = None
+                self._opath_version += 1
+        for each_callback in self.changed_listeners:
+            each_callback(self, fields)
+
+    def _set(self, field: str, value) -> T.NoReturn:
+        # Only tell anybody if it actually changed
+        if getattr(self, field) != value:
+            setattr(self, field, value)
+            self._notify_changed(field)
+
+    @staticmethod
+    def _lookup(youtube_url: str):
+        # Returns (meta, pafy object or None), or None if it's not a real video
+        # Seen this one before?
+        video_id = extract_video_id(youtube_url)
+        cached = metadata_cache.get(video_id) if video_id is not None else None
+        if cached is not None:
+            return cached, None
+
+        try:
+            pafy_obj = load_pafy().new(youtube_url, basic=True)
+        except ValueError:
+            # Not a valid URL / video ID
+            return None
+        except OSError:
+            # Not a real video
+            return None
+        else:
+            meta = VideoMeta.from_pafy(pafy_obj)
+            metadata_cache.put(meta)
+            return meta, pafy_obj
+
+    def _timed_lookup(self, youtube_url: str):
+        with metrics.stage(self.id, "resolve") as stage:
+            found = self._lookup(youtube_url)
+            if found is None:
+                stage.fail()
+        return found
 
     def set_url(self, youtube_url: T.Optional[str] = None) -> bool:
         if youtube_url == self.url:
             return True
         self.url = youtube_url
+        self.resolve_job = None
 
+        self.pafy = None
         if youtube_url is None:
-            self.pafy = None
+            self.meta = None
+            self.resolve_state = ResolveState.IDLE
+            self._notify_changed("url", "meta", "resolve_state")
             return True
 
-        else:    
-            try:
-                self.pafy = pafy.new(youtube_url, basic=True)
-            except ValueError:
-                # Not a valid URL / video ID
-                self.set_url(None)
-                return False
-            except OSError:
-                # Not a real video
-                self.set_url(None)
-                return False
+        found = self._timed_lookup(youtube_url)
+        if found is None:
+            self.set_url(None)
+            return False
+        else:
+            self.meta, self.pafy = found
+            self.resolve_state = ResolveState.RESOLVED
+            self._notify_changed("url", "meta", "resolve_state")
+            return True
+
+    def set_url_async(self, youtube_url: T.Optional[str] = None) -> T.Optional[Job]:
+        # Like set_url, but the lookup happens on the background scheduler.
+        # resolve_state says how it's going, and the resolve listeners hear
+        # about it once it's done. Failures leave the URL in place.
+        if youtube_url == self.url and self.resolve_state in (ResolveState.RESOLVING, ResolveState.RESOLVED):
+            return self.resolve_job
+        self.url = youtube_url
+        self.pafy = None
+        self.meta = None
+
+        if youtube_url is None:
+            self.resolve_job = None
+            self.resolve_state = ResolveState.IDLE
+        else:
+            self.resolve_state = ResolveState.RESOLVING
+            self.resolve_job = background_scheduler.submit(lambda: self._timed_lookup(youtube_url), name=f"resolve-{youtube_url}")
+            self.resolve_job.add_done_callback(lambda job: self._on_resolved(youtube_url, job))
+        self._notify_resolve()
+        return self.resolve_job
+
+    def _on_resolved(self, youtube_url: str, job: Job):
+        # Runs as the lookup's done callback, and from the download worker in
+        # case that gets there first. Whichever comes second does nothing.
+        with self._lock:
+            if youtube_url != self.url or job is not self.resolve_job:
+                # The URL changed while we were looking this one up
+                return
+            if self.resolve_state != ResolveState.RESOLVING:
+                return
+            if job.state == JobState.DONE and job.result is not None:
+                self.meta, self.pafy = job.result
+                self.resolve_state = ResolveState.RESOLVED
             else:
-                return True
+                self.resolve_state = ResolveState.FAILED
+        self._notify_resolve()
+
+    def _notify_resolve(self):
+        for each_callback in self.resolve_listeners:
+            each_callback(self.resolve_state)
+        self._notify_changed("url", "meta", "resolve_state")
+
+    def set_meta(self, youtube_url: str, meta: VideoMeta) -> T.NoReturn:
+        # For when the metadata was already looked up elsewhere (e.g. in a batch)
+        self.url = youtube_url
+        self.pafy = None
+        self.meta = meta
+        self.resolve_job = None
+        self.resolve_state = ResolveState.RESOLVED
+        self._notify_changed("url", "meta", "resolve_state")
+
+    def _get_pafy(self):
+        if self.pafy is None:
+            self.pafy = load_pafy().new(self.url, basic=True)
+        return self.pafy
+
+    def _best_stream(self, kind: str):
+        # kind is "audio" or "video". Stream URLs are cached for a few hours,
+        # so a retry doesn't have to scrape the watch page again.
+        cached = metadata_cache.get_stream(self.meta.video_id, kind)
+        if cached is not None:
+            return cached
+
+        with metrics.stage(self.id, "streams"):
+            if kind == "audio":
+                stream = self._get_pafy().getbestaudio()
+            else:
+                stream = self._get_pafy().getbest()
+        metadata_cache.put_stream(self.meta.video_id, kind, CachedStream.from_pafy(stream))
+        return stream
     
     def valid(self) -> bool:
-        return self.url is not None and self.pafy is not None
+        return self.url is not None and self.meta is not None
 
     def vtitle(self) -> str:
-        if self.pafy is None:
+        if self.meta is None:
             return ""
-        return self.pafy.title
+        return self.meta.title
     
     def vauthor(self) -> str:
-        if self.pafy is None:
+        if self.meta is None:
             return ""
-        return self.pafy.author
+        return self.meta.author
     
     def vthumbnail(self) -> str:
-        if self.pafy is None:
+        if self.meta is None or self.meta.thumbnail is None:
             return PLACEHOLDER_IMG
-        return self.pafy.getbestthumb()
+        return self.meta.thumbnail
 
     def vduration(self) -> int:
-        if self.pafy is None:
+        if self.meta is None:
             return 0
-        return self.pafy.length
+        return self.meta.duration
     
     def vformattedduration(self) -> str:
         total_seconds = self.vduration()
@@ -203,43 +528,99 @@ class DownloadEntry(object):
             return filenamify(f"{self.output_file}{self.oextension()}")
 
     def opath(self) -> str:
-        return os.path.join(self.odir(), self.ofilename())
+        path = self._opath
+        if path is not None:
+            return path
+        version = self._opath_version
+        path = os.path.join(self.odir(), self.ofilename())
+        with self._lock:
+            if self._opath_version == version:
+                self._opath = path
+        return path
     
     def set_output_dir(self, output_dir: T.Optional[str] = None) -> T.NoReturn:
-        self.output_dir = output_dir
+        self._set("output_dir", output_dir)
     
     def set_output_name(self, output_name: T.Optional[str] = None) -> T.NoReturn:
-        self.output_file = output_name
+        self._set("output_file", output_name)
     
     def set_download_type(self, audio_only: bool) -> T.NoReturn:
-        self.audio_only = audio_only
+        self._set("audio_only", audio_only)
     
     def set_download_subtitles(self, download_subtitles: bool) -> T.NoReturn:
-        self.subtitles = download_subtitles
+        self._set("subtitles", download_subtitles)
+
+    def set_burn_subtitles(self, burn_subtitles: bool) -> T.NoReturn:
+        self._set("burn_subtitles", burn_subtitles)
+
+    def set_title(self, title: T.Optional[str] = None) -> T.NoReturn:
+        self._set("title", title)
+
+    def set_author(self, author: T.Optional[str] = None) -> T.NoReturn:
+        self._set("author", author)
+
+    def video_id(self) -> T.Optional[str]:
+        if self.meta is not None:
+            return self.meta.video_id
+        if self.url is not None:
+            return extract_video_id(self.url)
+        return None
+
+    def profile(self) -> str:
+        # What kind of file this turns into, two entries with the same video
+        # and profile end up as the same thing
+        if self.audio_only:
+            return "audio"
+        elif self.burn_subtitles:
+            return "video+burned_subs"
+        else:
+            return "video"
+
+    def archive_key(self) -> T.Tuple[T.Optional[str], str]:
+        return (self.video_id(), self.profile())
+
+    def archived(self) -> T.Optional[ArchivedDownload]:
+        return download_archive.get(self.video_id(), self.profile())
 
     def exists_locally(self) -> bool:
-        return os.path.isfile(self.opath())
-    
-    def download(self, overwrite = False) -> bool:
-        if self.download_thread is not None:
+        return output_index.exists(self.opath()) or self.archived() is not None
+
+    def local_path(self) -> T.Optional[str]:
+        # Where the finished download is, even if it was saved under another name
+        if output_index.exists(self.opath()):
+            return self.opath()
+        archived = self.archived()
+        return archived.path if archived is not None else None
+
+    def check_archive(self) -> bool:
+        # Marks this as done without downloading anything if it already has been
+        if self.is_done or self.download_job is not None or not self.exists_locally():
+            return False
+        if self.meta is None and self.url is not None:
+            # Never gets looked up, so show whatever was known about it last time
+            cached = metadata_cache.get(self.video_id())
+            if cached is not None:
+                self.set_meta(self.url, cached)
+        self.editable = False
+        self._notify_changed("editable")
+        self._notify_progress(1.0)
+        self._notify_done(True)
+        return True
+
+    def download(self, overwrite = False, priority: int = 0) -> bool:
+        if self.download_job is not None:
             return True
 
         self.editable = False
         if self.exists_locally() and not overwrite:
-            self.download_progress = 1.0
-            for each_callback in self.progress_listeners:
-                each_callback(1.0)
-            for each_callback in self.done_listeners:
-                each_callback(True)
+            self._notify_progress(1.0)
+            self._notify_done(True)
             return True
         
-        if self.pafy is None:
+        if self.meta is None and self.resolve_state != ResolveState.RESOLVING:
             # Something's wrong, do nothing
-            self.download_progress = 0.0
-            for each_callback in self.progress_listeners:
-                each_callback(0.0)
-            for each_callback in self.done_listeners:
-                each_callback(False)
+            self._notify_progress(0.0)
+            self._notify_done(False)
             return False
         
         if self.audio_only:
@@ -247,78 +628,303 @@ class DownloadEntry(object):
         else:
             target = self._download_video
         
-        self.download_thread = threading.Thread(target=target, daemon=True)
-        self.download_thread.start()
-    
-    def _download_callback(self, total_bytes, unit_done, percentage, rate, eta):
-        self.download_progress = percentage
-        for each_callback in self.progress_listeners:
-            each_callback(self.download_progress)
+        metrics.start_job(self.id)
+        progress_hub.queue(self.id)
+        queue_timer = metrics.stage(self.id, "queued")
+        self.download_job = download_scheduler.submit(lambda: self._download_when_resolved(target, overwrite, queue_timer), priority=priority, name=self.id)
+        self.download_job.add_done_callback(self._on_job_finished)
+        self._notify_changed("editable", "download_job")
+        return True
+
+    def _download_when_resolved(self, target, overwrite: bool = False, queue_timer: T.Optional[StageTimer] = None):
+        # The job is running now, so it can't be removed from the queue anymore
+        if queue_timer is not None:
+            queue_timer.stop()
+        self._notify_changed("download_job")
+
+        # Downloads can be queued while the lookup is still running
+        resolve_job = self.resolve_job
+        if resolve_job is not None:
+            resolve_job.wait()
+            # wait() can return before the done callback has filled in meta
+            self._on_resolved(self.url, resolve_job)
+        if self.meta is None:
+            self.download_progress = 0.0
+            self._notify_done(False)
+            return
+        if not overwrite and self.exists_locally():
+            # Only knew which video it was once the lookup came back
+            self.download_progress = 1.0
+            metrics.finish_job(self.id, "skipped", **self._job_fields())
+            self._notify_done(True)
+            return
+        self._start_subtitles()
+        target()
+
+    def cancel(self) -> bool:
+        # Pull a queued download back out of the scheduler
+        if self.download_job is not None and self.download_job.cancel():
+            self.download_job = None
+            self.editable = True
+            progress_hub.remove(self.id)
+            metrics.finish_job(self.id, "cancelled", **self._job_fields())
+            self._notify_changed("editable", "download_job")
+            return True
+        return False
 
-    def _download_common(self, stream, postprocess):
-        self.download_progress = 0.0
+    def job_state(self) -> T.Optional[str]:
+        if self.download_job is None:
+            return None
+        return self.download_job.state
 
-        # Download the video / audio stream
-        dl_path = f"{os.path.splitext(self.opath())[0]}.{stream.extension}"
-        stream.download(filepath=dl_path, callback=self._download_callback)
+    def _on_job_finished(self, job: Job):
+        if job.state == JobState.FAILED:
+            # The worker blew up before it could report anything
+            self._notify_done(False)
 
-        # Now it's done. Download the subtitles if we need them.
-        if self.subtitles:
-            subtitles_path = self._download_subtitles()
-        else:
-            subtitles_path = None
+    def _notify_progress(self, amount: float):
+        self.download_progress = amount
+        for each_callback in self.progress_listeners:
+            each_callback(amount)
+
+    def _notify_done(self, success: bool):
+        self.is_done = True
+        self.success = success
+        progress_hub.finish(self.id, success)
+        metrics.finish_job(self.id, "success" if success else "failed", **self._job_fields())
+        for each_callback in self.done_listeners:
+            each_callback(success)
+        self._notify_changed("is_done", "success")
+    
+    def _download_callback(self, total_bytes, unit_done, percentage, rate, eta):
+        progress_hub.update(self.id, total_bytes, unit_done, rate, eta)
+        self._notify_progress(percentage)
 
+    def _download_common(self, stream, postprocess, stream_postprocess, then: T.Callable[[T.Optional[str]], T.Any]) -> T.NoReturn:
+        # Calls then() with the converted path (or None) once it's all done.
+        # That might be later, on a conversion worker.
+        self.download_progress = 0.0
+        progress_hub.start(self.id, stream.get_filesize())
+
+        # A half-finished file from an earlier attempt is worth more than
+        # streaming, since the file path can pick it up where it stopped.
+        # Streaming runs ffmpeg right here, so it needs a free conversion
+        # slot. Without one, downloading to a file and queueing the conversion
+        # keeps the CPU from being oversubscribed.
+        dl_path = self._stream_download_path(stream)
+        converted_path = None
+        if self.streaming and not has_partial(dl_path) and not self._wants_segments(stream) and conversion_slots.try_acquire():
+            try:
+                converted_path = self._download_streaming(stream, stream_postprocess)
+            finally:
+                conversion_slots.release()
+            if converted_path is None:
+                print("WARNING: Streaming conversion failed, retrying through a file.", file=sys.stderr)
+                self.download_progress = 0.0
+
+        if converted_path is not None:
+            then(self._finish_download(converted_path))
+            return
+
+        dl_path = self._download_to_file(stream)
+        if dl_path is None:
+            then(None)
+            return
+
+        # The subtitles have most likely been sitting there a while
+        subtitles_path = self._wait_subtitles()
         burned_subtitle_path = None if not self.burn_subtitles else subtitles_path
 
-        converted_path = postprocess(dl_path, burned_subtitles = burned_subtitle_path, remove_old=True)
-
-        if converted_path is None:
-            # Failure!
-            for each_callback in self.done_listeners:
-                each_callback(False)
-    
-        else:
+        # Converting is all CPU, so hand it to the conversion pool and let
+        # this worker get on with the next download
+        queue_timer = metrics.stage(self.id, "convert_queued")
+        def convert():
+            metadata, cover_art = self._output_metadata(), self._cover_art()
+            with conversion_slots:
+                queue_timer.stop()
+                with metrics.stage(self.id, "convert") as stage:
+                    stage.nbytes = os.path.getsize(dl_path)
+                    converted_path = postprocess(dl_path, burned_subtitles = burned_subtitle_path, remove_old=True, report=self._on_conversion_path, metadata=metadata, cover_art=cover_art)
+                    if converted_path is None:
+                        stage.fail()
+            then(self._finish_download(converted_path))
+        self.conversion_job = conversion_scheduler.submit(convert, name=f"convert-{self.id}")
+        self.conversion_job.add_done_callback(self._on_job_finished)
+
+    def _download_streaming(self, stream, stream_postprocess) -> T.Optional[str]:
+        # Burning needs the subtitles in the filter graph before any bytes
+        # arrive, so that has to wait for them. Otherwise they carry on alongside.
+        burned_subtitle_path = self._wait_subtitles() if self.burn_subtitles else None
+        metadata, cover_art = self._output_metadata(), self._cover_art()
+
+        with metrics.stage(self.id, "stream_convert") as stage:
+            try:
+                chunks = iter_url_chunks(stream.url, callback=self._download_callback, total=stream.get_filesize())
+                converted_path = stream_postprocess(chunks, self.opath(), input_ext=f".{stream.extension}", burned_subtitles=burned_subtitle_path, probe_source=stream.url, report=self._on_conversion_path, metadata=metadata, cover_art=cover_art)
+            except Exception as err:
+                print(f"Streaming Error: {err}", file=sys.stderr)
+                converted_path = None
+            if converted_path is None:
+                stage.fail()
+            else:
+                stage.nbytes = stream.get_filesize()
+        return converted_path
+
+    def _stream_download_path(self, stream) -> str:
+        return f"{os.path.splitext(self.opath())[0]}.{stream.extension}"
+
+    def _wants_segments(self, stream) -> bool:
+        # Past this size, parallel connections win over overlapping the conversion
+        return self.segments > 1 and stream.get_filesize() >= SEGMENTED_MIN_SIZE
+
+    def _stream_identity(self, stream) -> str:
+        # Stream URLs change every time they're looked up, so go by what's in them
+        kind = "audio" if self.audio_only else "video"
+        return f"{self.meta.video_id}:{kind}:{stream.extension}:{stream.get_filesize()}"
+
+    def _download_to_file(self, stream) -> T.Optional[str]:
+        # Download the video / audio stream. Goes through a .part file so an
+        # interrupted download can be resumed instead of looking finished.
+        dl_path = self._stream_download_path(stream)
+        with metrics.stage(self.id, "download") as stage:
+            try:
+                if self._wants_segments(stream):
+                    segmented_download(stream.url, dl_path, stream.get_filesize(), self._stream_identity(stream), callback=self._download_callback, segments=self.segments, on_retry=stage.retried)
+                else:
+                    resumable_download(stream.url, dl_path, stream.get_filesize(), self._stream_identity(stream), callback=self._download_callback, on_retry=stage.retried)
+            except Exception as err:
+                print(f"Download Error: {err}", file=sys.stderr)
+                stage.fail()
+                return None
+            stage.nbytes = stream.get_filesize()
+        return dl_path
+
+    def _on_conversion_path(self, path: str):
+        self.conversion_path = path
+
+    def _finish_download(self, converted_path: T.Optional[str]) -> T.Optional[str]:
+        # Not done until the subtitles are there too
+        self._wait_subtitles()
+        if converted_path is not None:
             output_dir, converted_fn = os.path.split(converted_path)
             
             converted_base, converted_ext = os.path.splitext(converted_fn)
             self.output_dir = output_dir
             self.output_file = converted_base
             self.output_extension = converted_ext
-
-
-            for each_callback in self.done_listeners:
-                each_callback(True)
+            self._notify_changed("output_dir", "output_file", "output_extension")
+        return converted_path
 
     def _download_audio(self):
-        with downloading_lock:
-            audiostream = self.pafy.getbestaudio()
-            self._download_common(audiostream, extract_audio)
-            # Finally, tag it!
-            tag_file(self.opath(), self.otitle(), self.oauthor())
-            self.is_done = True
+        audiostream = self._best_stream("audio")
+        self._download_common(audiostream, extract_audio, extract_audio_stream, self._audio_converted)
+
+    def _audio_converted(self, converted_path: T.Optional[str]):
+        if converted_path is not None:
+            self._tag_if_unconverted()
+            self._record_download()
+        self._notify_done(converted_path is not None)
 
     def _download_video(self):
-        with downloading_lock:
-            videostream = self.pafy.getbest()
-            self._download_common(videostream, convert_video)
-            self.is_done = True
+        videostream = self._best_stream("video")
+        self._download_common(videostream, convert_video, convert_video_stream, self._video_converted)
+
+    def _video_converted(self, converted_path: T.Optional[str]):
+        if converted_path is not None:
+            self._tag_if_unconverted()
+            self._record_download()
+        self._notify_done(converted_path is not None)
+
+    def _output_metadata(self) -> T.Dict[str, str]:
+        # Written into the file by ffmpeg while converting
+        video_id = self.video_id()
+        return {
+            "title": self.otitle(),
+            "artist": self.oauthor(),
+            "comment": f"https://www.youtube.com/watch?v={video_id}" if video_id is not None else self.url,
+            "video_id": video_id,
+        }
+
+    def _cover_art(self) -> T.Optional[str]:
+        # The thumbnail, for audio downloads. Usually it's already on disk from
+        # being shown in the queue.
+        if not self.audio_only or self.meta is None or self.meta.thumbnail is None:
+            return None
+        with metrics.stage(self.id, "cover_art") as stage:
+            try:
+                cover_art = thumbnail_cache.get(self.meta.thumbnail, "detail")
+            except Exception as err:
+                print(f"WARNING: No cover art: {err}", file=sys.stderr)
+                cover_art = None
+            if cover_art is None:
+                stage.fail()
+        return cover_art
+
+    def _tag_if_unconverted(self):
+        # ffmpeg already tagged anything it touched, so this is only for
+        # downloads that went straight to disk as they were
+        if self.conversion_path != ConversionPath.NONE:
+            return
+        metadata = self._output_metadata()
+        cover_art = self._cover_art()
+        with metrics.stage(self.id, "tag") as stage:
+            try:
+                tag_file(self.opath(), metadata["title"], metadata["artist"], metadata["comment"], metadata["video_id"], cover_art)
+            except Exception as err:
+                print(f"WARNING: Couldn't tag {self.opath()}: {err}", file=sys.stderr)
+                stage.fail()
+
+    def _job_fields(self) -> T.Dict[str, T.Any]:
+        # What the trace says about each finished job
+        return {
+            "video_id": self.video_id(),
+            "profile": self.profile(),
+            "conversion_path": self.conversion_path,
+            "streaming": self.streaming,
+            "segments": self.segments,
+        }
+
+    def _record_download(self):
+        # Don't wait for the next rescan to notice it
+        output_index.note_added(self.opath())
+        download_archive.record(self.video_id(), self.profile(), self.opath())
+
+    def _start_subtitles(self):
+        # Runs on the background scheduler while the media downloads, instead
+        # of after it
+        if self.subtitles and self.url is not None:
+            self.subtitles_job = background_scheduler.submit(self._download_subtitles, priority=-1, name=f"subtitles-{self.id}")
+        else:
+            self.subtitles_job = None
+
+    def _wait_subtitles(self) -> T.Optional[str]:
+        # Path to the (first language's) subtitles once they're saved, if any
+        if self.subtitles_job is None:
+            return None
+        self.subtitles_job.wait()
+        return self.subtitles_job.result
 
     def _download_subtitles(self):
         if self.url is not None:
-            return download_subtitles(self.url, self.opath())
+            with metrics.stage(self.id, "subtitles") as stage:
+                subtitles_path = download_subtitles(self.url, self.opath(), self.subtitle_languages)
+                if subtitles_path is None:
+                    stage.fail()
+            return subtitles_path
         else:
             return None
 
     def reveal_in_explorer(self):
-        if self.exists_locally():
-            command = f"explorer {self.odir()}"
+        path = self.local_path()
+        if path is not None:
+            command = f"explorer {os.path.dirname(path)}"
             os.system(command)
         
     def is_downloadable(self) -> bool:
-        return self.pafy is not None and self.download_thread is None and self.editable and not self.exists_locally()
+        return (self.meta is not None or self.resolve_state == ResolveState.RESOLVING) and self.download_job is None and self.editable and not self.exists_locally()
 
     def is_forgettable(self) -> bool:
-        return self.download_thread is None or self.is_done
+        return self.download_job is None or self.is_done or self.download_job.state == JobState.QUEUED
 
     def is_revealable(self) -> bool:
         return self.exists_locally()
@@ -1,3 +0,0 @@
-import threading
-
-downloading_lock: threading.Lock = threading.Lock()
\ No newline at end of file
@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+import threading
+
+import typing as T
+
+if T.TYPE_CHECKING:
+    import requests
+
+CHUNK_SIZE = 64 * 1024
+# Seconds to connect, and to wait for each read. A connection that stalls
+# without closing raises instead of holding up the download forever.
+REQUEST_TIMEOUT = (10, 30)
+
+# Same shape as pafy's download callback:
+# (total bytes, bytes done, fraction done, rate in KB/s, eta in seconds)
+ProgressCallback = T.Callable[[int, int, float, float, float], T.Any]
+# Told about each error a download is about to retry after
+RetryCallback = T.Callable[[BaseException], T.Any]
+
+class ProgressTracker(object):
+    def __init__(self, total: int, callback: T.Optional[ProgressCallback] = None, offset: int = 0):
+        self.total = total
+        self.callback = callback
+        self.offset = offset
+        self.done = offset
+        self.started = time.time()
+
+    def update(self, nbytes: int) -> T.NoReturn:
+        self.done += nbytes
+        if self.callback is None:
+            return
+
+        elapsed = max(time.time() - self.started, 1e-6)
+        # Rate only counts what we fetched this time around, not what was resumed
+        rate = ((self.done - self.offset) / 1024.0) / elapsed
+        if self.total > 0:
+            fraction = min(self.done / self.total, 1.0)
+            eta = (self.total - self.done) / max(rate * 1024.0, 1e-6)
+        else:
+            fraction = 0.0
+            eta = 0.0
+        self.callback(self.total, self.done, fraction, rate, eta)
+
+def iter_url_chunks(url: str, callback: T.Optional[ProgressCallback] = None, total: int = 0, session: T.Optional["requests.Session"] = None, chunk_size: int = CHUNK_SIZE) -> T.Iterator[bytes]:
+    # requests is imported here rather than up top to keep startup quick
+    import requests
+    getter = session if session is not None else requests
+    with getter.get(url, stream=True, timeout=REQUEST_TIMEOUT) as response:
+        response.raise_for_status()
+        if total <= 0:
+            total = int(response.headers.get("Content-Length", 0))
+        tracker = ProgressTracker(total, callback)
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if chunk:
+                tracker.update(len(chunk))
+                yield chunk
+
+# How often the journal gets updated while downloading
+JOURNAL_INTERVAL = 4 * 1024 * 1024
+# Times to pick a dropped connection back up before giving up
+DOWNLOAD_RETRIES = 5
+
+def part_path_for(filepath: str) -> str:
+    # Where a file lives until it's complete, for downloads and conversions
+    # alike. ffmpeg picks the format from the extension, so that stays at the end.
+    name_only, ext = os.path.splitext(filepath)
+    return f"{name_only}.part{ext}"
+
+class PartJournal(object):
+    # Sits next to a .part file and says how much of it is safely on disk,
+    # and which stream it belongs to, so an interrupted download can pick
+    # up where it left off.
+    def __init__(self, part_path: str):
+        self.path = f"{part_path}.json"
+
+    def load(self) -> T.Optional[T.Dict[str, T.Any]]:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, identity: str, expected_size: int, committed: int) -> T.NoReturn:
+        temp_path = f"{self.path}.temp"
+        with open(temp_path, "w") as f:
+            json.dump({"identity": identity, "expected_size": expected_size, "committed": committed}, f)
+        os.replace(temp_path, self.path)
+
+    def delete(self) -> T.NoReturn:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class SegmentJournal(PartJournal):
+    # Same file, but tracks each segment's committed bytes instead of one offset
+    def save(self, identity: str, expected_size: int, segments: T.List[T.List[int]]) -> T.NoReturn:
+        temp_path = f"{self.path}.temp"
+        with open(temp_path, "w") as f:
+            json.dump({"identity": identity, "expected_size": expected_size, "segments": segments}, f)
+        os.replace(temp_path, self.path)
+
+def has_partial(filepath: str) -> bool:
+    part_path = part_path_for(filepath)
+    return os.path.isfile(part_path) and os.path.isfile(PartJournal(part_path).path)
+
+def resumable_download(url: str, filepath: str, expected_size: int, identity: str, callback: T.Optional[ProgressCallback] = None, session: T.Optional["requests.Session"] = None, retries: int = DOWNLOAD_RETRIES, chunk_size: int = CHUNK_SIZE, on_retry: T.Optional[RetryCallback] = None) -> str:
+    # Downloads into part_path_for(filepath), and only renames it once it's
+    # all there. If a journal from an earlier attempt at the same stream is
+    # lying around, carries on from its last committed offset with a Range request.
+    import requests
+    getter = session if session is not None else requests
+    part_path = part_path_for(filepath)
+    journal = PartJournal(part_path)
+
+    offset = 0
+    previous = journal.load()
+    if previous is not None and os.path.isfile(part_path) and previous.get("identity") == identity and previous.get("expected_size") == expected_size:
+        offset = min(int(previous.get("committed", 0)), os.path.getsize(part_path))
+    else:
+        # Nothing usable, start over
+        with open(part_path, "wb"):
+            pass
+    journal.save(identity, expected_size, offset)
+
+    tracker = ProgressTracker(expected_size, callback, offset=offset)
+    attempt = 0
+    while expected_size <= 0 or offset < expected_size:
+        headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+        try:
+            with getter.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                response.raise_for_status()
+                if offset > 0 and response.status_code != 206:
+                    # Server ignored the range, so this is the whole file again
+                    offset = 0
+                    tracker = ProgressTracker(expected_size, callback)
+                with open(part_path, "r+b") as f:
+                    f.seek(offset)
+                    f.truncate()
+                    since_commit = 0
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+                        offset += len(chunk)
+                        since_commit += len(chunk)
+                        tracker.update(len(chunk))
+                        if since_commit >= JOURNAL_INTERVAL:
+                            # Only journal what has really hit the disk
+                            f.flush()
+                            os.fsync(f.fileno())
+                            journal.save(identity, expected_size, offset)
+                            since_commit = 0
+                    f.flush()
+                    os.fsync(f.fileno())
+                journal.save(identity, expected_size, offset)
+            if expected_size <= 0:
+                # No size to check against, the server closing cleanly will have to do
+                break
+            if offset < expected_size:
+                raise IOError(f"Connection closed at {offset} of {expected_size} bytes")
+        except (requests.RequestException, IOError) as err:
+            journal.save(identity, expected_size, offset)
+            attempt += 1
+            if attempt > retries:
+                raise
+            print(f"WARNING: Download interrupted ({err}), resuming at byte {offset}", file=sys.stderr)
+            if on_retry is not None:
+                on_retry(err)
+            time.sleep(min(2 ** attempt, 30))
+
+    os.replace(part_path, filepath)
+    journal.delete()
+    return filepath
+
+# Big streams get split into this many ranges, fetched side by side
+SEGMENT_COUNT = 4
+# Don't bother splitting anything smaller than this per segment
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+
+class RangeNotSupported(IOError):
+    pass
+
+def segmented_download(url: str, filepath: str, expected_size: int, identity: str, callback: T.Optional[ProgressCallback] = None, segments: int = SEGMENT_COUNT, retries: int = DOWNLOAD_RETRIES, chunk_size: int = CHUNK_SIZE, on_retry: T.Optional[RetryCallback] = None) -> str:
+    # Like resumable_download, but fetches several byte ranges at once over
+    # separate connections, each written straight into its place in a
+    # preallocated .part file. Segments retry on their own, and the journal
+    # keeps track of each one so this can be resumed too.
+    import requests
+    nsegments = min(segments, expected_size // MIN_SEGMENT_SIZE) if expected_size > 0 else 0
+    if nsegments <= 1:
+        return resumable_download(url, filepath, expected_size, identity, callback=callback, retries=retries, chunk_size=chunk_size, on_retry=on_retry)
+
+    part_path = part_path_for(filepath)
+    journal = SegmentJournal(part_path)
+
+    # Each range is [start, end (exclusive), bytes committed]
+    previous = journal.load()
+    if previous is not None and previous.get("identity") == identity and previous.get("expected_size") == expected_size and "segments" in previous and os.path.isfile(part_path) and os.path.getsize(part_path) == expected_size:
+        ranges = previous["segments"]
+    else:
+        step = expected_size // nsegments
+        ranges = [[i * step, (i + 1) * step if i < nsegments - 1 else expected_size, 0] for i in range(nsegments)]
+        with open(part_path, "wb") as f:
+            f.truncate(expected_size)
+    journal.save(identity, expected_size, ranges)
+
+    lock = threading.Lock()
+    tracker = ProgressTracker(expected_size, callback, offset=sum(r[2] for r in ranges))
+    errors: T.List[BaseException] = []
+
+    def fetch_segment(index: int):
+        start, end, _ = ranges[index]
+        session = requests.Session()
+        attempt = 0
+        with open(part_path, "r+b") as f:
+            while ranges[index][2] < end - start:
+                offset = start + ranges[index][2]
+                try:
+                    with session.get(url, headers={"Range": f"bytes={offset}-{end - 1}"}, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                        response.raise_for_status()
+                        if response.status_code != 206:
+                            raise RangeNotSupported("Server doesn't do byte ranges")
+                        f.seek(offset)
+                        since_commit = 0
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            if not chunk:
+                                continue
+                            # Don't trust the server to stop at the end of the range
+                            chunk = chunk[:end - offset]
+                            f.write(chunk)
+                            offset += len(chunk)
+                            since_commit += len(chunk)
+                            with lock:
+                                tracker.update(len(chunk))
+                            if since_commit >= JOURNAL_INTERVAL:
+                                f.flush()
+                                os.fsync(f.fileno())
+                                with lock:
+                                    ranges[index][2] = offset - start
+                                    journal.save(identity, expected_size, ranges)
+                                since_commit = 0
+                            if offset >= end:
+                                break
+                        f.flush()
+                        os.fsync(f.fileno())
+                        with lock:
+                            ranges[index][2] = offset - start
+                            journal.save(identity, expected_size, ranges)
+                    if offset < end:
+                        # Closed early without an error, which needs the same
+                        # retry limit and backoff as a dropped connection
+                        raise IOError(f"Segment {index} closed at {offset} of {end} bytes")
+                except RangeNotSupported:
+                    raise
+                except (requests.RequestException, IOError) as err:
+                    # Carry on from what was written, same as resumable_download.
+                    # Those bytes were already counted towards the progress.
+                    f.flush()
+                    os.fsync(f.fileno())
+                    with lock:
+                        ranges[index][2] = offset - start
+                        journal.save(identity, expected_size, ranges)
+                    attempt += 1
+                    if attempt > retries:
+                        raise
+                    print(f"WARNING: Segment {index} interrupted ({err}), retrying", file=sys.stderr)
+                    if on_retry is not None:
+                        on_retry(err)
+                    time.sleep(min(2 ** attempt, 30))
+        session.close()
+
+    def run_segment(index: int):
+        try:
+            fetch_segment(index)
+        except BaseException as err:
+            with lock:
+                errors.append(err)
+
+    workers = [threading.Thread(target=run_segment, args=(i,), daemon=True) for i in range(len(ranges)) if ranges[i][2] < ranges[i][1] - ranges[i][0]]
+    for each_worker in workers:
+        each_worker.start()
+    for each_worker in workers:
+        each_worker.join()
+
+    if len(errors) > 0:
+        if any(isinstance(err, RangeNotSupported) for err in errors):
+            # Fall back to a single plain connection
+            journal.delete()
+            os.remove(part_path)
+            return resumable_download(url, filepath, expected_size, identity, callback=callback, retries=retries, chunk_size=chunk_size, on_retry=on_retry)
+        raise errors[0]
+
+    os.replace(part_path, filepath)
+    journal.delete()
+    return filepath
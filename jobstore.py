@@ -0,0 +1,122 @@
+import threading
+import time
+
+import typing as T
+
+from . import DEFAULT_JOB_STORE
+from .sqlitestore import SQLiteStore
+from .dlmanager import DownloadEntry
+
+# Changes are gathered up for this long and then written in one go
+FLUSH_DELAY = 0.5
+
+COLUMNS = [
+    "id", "url", "video_id", "v_title", "v_author", "v_duration", "v_thumbnail",
+    "audio_only", "subtitles", "burn_subtitles", "title", "author",
+    "output_dir", "output_file", "output_extension",
+    "is_done", "success", "conversion_path",
+]
+
+class JobStore(SQLiteStore):
+    # The download queue, on disk. Entries added through here are watched,
+    # and whatever changes about them gets written back shortly after.
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            position INTEGER,
+            url TEXT,
+            video_id TEXT,
+            v_title TEXT,
+            v_author TEXT,
+            v_duration INTEGER,
+            v_thumbnail TEXT,
+            audio_only INTEGER,
+            subtitles INTEGER,
+            burn_subtitles INTEGER,
+            title TEXT,
+            author TEXT,
+            output_dir TEXT,
+            output_file TEXT,
+            output_extension TEXT,
+            is_done INTEGER,
+            success INTEGER,
+            conversion_path TEXT,
+            updated_at REAL
+        )""",
+        "CREATE INDEX IF NOT EXISTS jobs_position ON jobs (position)",
+    ]
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._pending: T.Dict[str, DownloadEntry] = {}
+        self._pending_lock = threading.Lock()
+        self._flush_timer: T.Optional[threading.Timer] = None
+        self._next_position: T.Optional[int] = None
+
+    def _take_position(self, count: int) -> int:
+        with self._lock:
+            if self._next_position is None:
+                self._next_position = (self.query("SELECT MAX(position) FROM jobs")[0][0] or 0) + 1
+            position = self._next_position
+            self._next_position += count
+            return position
+
+    def load_all(self) -> T.List[DownloadEntry]:
+        rows = self.query(f"SELECT {', '.join(COLUMNS)} FROM jobs ORDER BY position")
+        entries = [DownloadEntry.from_record(dict(zip(COLUMNS, row))) for row in rows]
+        for each_entry in entries:
+            self.watch(each_entry)
+        return entries
+
+    def add(self, entry: DownloadEntry) -> T.NoReturn:
+        self.add_many([entry])
+
+    def add_many(self, entries: T.Sequence[DownloadEntry]) -> T.NoReturn:
+        position = self._take_position(len(entries))
+        now = time.time()
+        rows = []
+        for offset, each_entry in enumerate(entries):
+            record = each_entry.to_record()
+            rows.append([record[c] for c in COLUMNS] + [position + offset, now])
+            self.watch(each_entry)
+        self.executemany(
+            f"INSERT OR REPLACE INTO jobs ({', '.join(COLUMNS)}, position, updated_at) VALUES ({', '.join('?' * (len(COLUMNS) + 2))})",
+            rows
+        )
+
+    def remove(self, entry: DownloadEntry) -> T.NoReturn:
+        with self._pending_lock:
+            self._pending.pop(entry.id, None)
+        self.execute("DELETE FROM jobs WHERE id = ?", (entry.id,))
+
+    def watch(self, entry: DownloadEntry) -> T.NoReturn:
+        entry.bind(changed=self._on_entry_changed)
+
+    def _on_entry_changed(self, entry: DownloadEntry, fields: T.Tuple[str, ...]):
+        with self._pending_lock:
+            self._pending[entry.id] = entry
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(FLUSH_DELAY, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self) -> T.NoReturn:
+        with self._pending_lock:
+            pending = self._pending
+            self._pending = {}
+            self._flush_timer = None
+        if len(pending) == 0:
+            return
+        now = time.time()
+        updated = [c for c in COLUMNS if c != "id"]
+        rows = []
+        for each_entry in pending.values():
+            record = each_entry.to_record()
+            rows.append([record[c] for c in updated] + [now, record["id"]])
+        # Entries removed in the meantime just don't match anything
+        self.executemany(
+            f"UPDATE jobs SET {', '.join(f'{c} = ?' for c in updated)}, updated_at = ? WHERE id = ?",
+            rows
+        )
+
+job_store = JobStore(DEFAULT_JOB_STORE)
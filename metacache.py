@@ -0,0 +1,174 @@
+import time
+import urllib.parse as urlparse
+
+import typing as T
+
+from . import DEFAULT_METADATA_CACHE
+from .sqlitestore import SQLiteStore
+
+# Stream URLs stop working after a few hours, so never trust them for longer than this
+STREAM_TTL = 5 * 60 * 60
+# Titles and such barely change, but refresh them once in a while anyway
+METADATA_TTL = 30 * 24 * 60 * 60
+# Least recently used videos get dropped past this many
+MAX_CACHED_VIDEOS = 50000
+# Once it's full, make this much room at a time instead of a row per put
+EVICT_BATCH = 1000
+
+class VideoMeta(object):
+    def __init__(self, video_id: str, title: str, author: str, duration: int, thumbnail: T.Optional[str]):
+        self.video_id = video_id
+        self.title = title
+        self.author = author
+        self.duration = duration
+        self.thumbnail = thumbnail
+
+    @classmethod
+    def from_pafy(cls, pafy_obj) -> "VideoMeta":
+        return cls(pafy_obj.videoid, pafy_obj.title, pafy_obj.author, int(pafy_obj.length), pafy_obj.getbestthumb())
+
+class CachedStream(object):
+    # Just enough of a pafy stream to download from a URL we saw earlier
+    def __init__(self, url: str, extension: str, filesize: int):
+        self.url = url
+        self.extension = extension
+        self.filesize = filesize
+
+    @classmethod
+    def from_pafy(cls, stream) -> "CachedStream":
+        return cls(stream.url, stream.extension, int(stream.get_filesize() or 0))
+
+    def get_filesize(self) -> int:
+        return self.filesize
+
+def stream_expiry(url: str, now: float) -> float:
+    # googlevideo URLs say when they expire, use that when it's sooner
+    expires = now + STREAM_TTL
+    args = urlparse.parse_qs(urlparse.urlparse(url).query)
+    try:
+        expires = min(expires, float(args.get("expire", [expires])[0]))
+    except ValueError:
+        pass
+    return expires
+
+class MetadataCache(SQLiteStore):
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS videos (
+            video_id TEXT PRIMARY KEY,
+            title TEXT,
+            author TEXT,
+            duration INTEGER,
+            thumbnail TEXT,
+            fetched_at REAL,
+            last_used REAL
+        )""",
+        "CREATE INDEX IF NOT EXISTS videos_last_used ON videos (last_used)",
+        """CREATE TABLE IF NOT EXISTS streams (
+            video_id TEXT,
+            kind TEXT,
+            url TEXT,
+            extension TEXT,
+            filesize INTEGER,
+            expires_at REAL,
+            PRIMARY KEY (video_id, kind)
+        )""",
+    ]
+
+    def __init__(self, path: str, max_videos: int = MAX_CACHED_VIDEOS):
+        super().__init__(path)
+        self.max_videos = max_videos
+        # At least how many videos are stored, so evict doesn't have to count
+        # them on every put. Replacing a row counts as adding one, which just
+        # means a real count comes a little early.
+        self._video_count: T.Optional[int] = None
+
+    def get(self, video_id: str) -> T.Optional[VideoMeta]:
+        now = time.time()
+        rows = self.query("SELECT title, author, duration, thumbnail, fetched_at FROM videos WHERE video_id = ?", (video_id,))
+        if len(rows) == 0:
+            return None
+        title, author, duration, thumbnail, fetched_at = rows[0]
+        if now - fetched_at > METADATA_TTL:
+            return None
+        self.execute("UPDATE videos SET last_used = ? WHERE video_id = ?", (now, video_id))
+        return VideoMeta(video_id, title, author, duration, thumbnail)
+
+    def get_many(self, video_ids: T.Sequence[str]) -> T.Dict[str, VideoMeta]:
+        now = time.time()
+        found = {}
+        # Stay under SQLite's limit on query parameters
+        for start in range(0, len(video_ids), 500):
+            batch = list(video_ids[start:start + 500])
+            placeholders = ",".join("?" * len(batch))
+            rows = self.query(
+                f"SELECT video_id, title, author, duration, thumbnail, fetched_at FROM videos WHERE video_id IN ({placeholders})",
+                batch
+            )
+            for video_id, title, author, duration, thumbnail, fetched_at in rows:
+                if now - fetched_at <= METADATA_TTL:
+                    found[video_id] = VideoMeta(video_id, title, author, duration, thumbnail)
+        if len(found) > 0:
+            self.executemany("UPDATE videos SET last_used = ? WHERE video_id = ?", [(now, i) for i in found])
+        return found
+
+    def put(self, meta: VideoMeta) -> T.NoReturn:
+        self.put_many([meta])
+
+    def put_many(self, metas: T.Iterable[VideoMeta]) -> T.NoReturn:
+        now = time.time()
+        metas = list(metas)
+        self.executemany(
+            "INSERT OR REPLACE INTO videos (video_id, title, author, duration, thumbnail, fetched_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(m.video_id, m.title, m.author, m.duration, m.thumbnail, now, now) for m in metas]
+        )
+        with self._lock:
+            if self._video_count is not None:
+                self._video_count += len(metas)
+        self.evict()
+
+    def get_stream(self, video_id: str, kind: str) -> T.Optional[CachedStream]:
+        rows = self.query("SELECT url, extension, filesize, expires_at FROM streams WHERE video_id = ? AND kind = ?", (video_id, kind))
+        if len(rows) == 0:
+            return None
+        url, extension, filesize, expires_at = rows[0]
+        if time.time() >= expires_at:
+            # Stale, the URL won't work anymore
+            self.execute("DELETE FROM streams WHERE video_id = ? AND kind = ?", (video_id, kind))
+            return None
+        return CachedStream(url, extension, filesize)
+
+    def put_stream(self, video_id: str, kind: str, stream: CachedStream) -> T.NoReturn:
+        self.execute(
+            "INSERT OR REPLACE INTO streams (video_id, kind, url, extension, filesize, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (video_id, kind, stream.url, stream.extension, stream.filesize, stream_expiry(stream.url, time.time()))
+        )
+
+    def evict(self) -> T.NoReturn:
+        with self._lock:
+            if self._video_count is not None and self._video_count <= self.max_videos:
+                return
+            count = self.query("SELECT COUNT(*) FROM videos")[0][0]
+            if count <= self.max_videos:
+                self._video_count = count
+                return
+            extra = count - self.max_videos + min(EVICT_BATCH, self.max_videos // 10)
+            self._video_count = count - extra
+            conn = self._connection()
+            conn.execute(
+                "DELETE FROM streams WHERE video_id IN (SELECT video_id FROM videos ORDER BY last_used ASC LIMIT ?)",
+                (extra,)
+            )
+            conn.execute(
+                "DELETE FROM videos WHERE video_id IN (SELECT video_id FROM videos ORDER BY last_used ASC LIMIT ?)",
+                (extra,)
+            )
+            conn.execute("DELETE FROM streams WHERE expires_at <= ?", (time.time(),))
+            conn.commit()
+
+    def close(self) -> T.NoReturn:
+        # The path might change before it's opened again
+        with self._lock:
+            self._video_count = None
+        super().close()
+
+metadata_cache = MetadataCache(DEFAULT_METADATA_CACHE)
@@ -0,0 +1,292 @@
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+import typing as T
+
+# Where the time goes in each download. Every stage of DownloadEntry's
+# pipeline is timed (along with how many bytes it moved, how often it had to
+# retry and whether it worked), and kept two ways:
+#  - rolling histograms per stage, for the Prometheus text format, served
+#    over HTTP and/or written to a file
+#  - one JSON line per finished job in a trace file, with all its stages
+#
+# The stages, roughly in the order a download goes through them: resolve,
+# queued, streams, subtitles, cover_art, download or stream_convert,
+# convert_queued, convert, tag. queued and convert_queued are time spent
+# waiting on a scheduler for a free worker.
+
+# The histograms only look at this many of the latest samples of each stage
+HISTOGRAM_WINDOW = 1000
+QUANTILES = [0.5, 0.9, 0.99]
+# Jobs that have had stages timed but haven't finished. Entries that are
+# looked up and never downloaded would otherwise pile up forever.
+MAX_OPEN_TRACES = 10000
+METRIC_PREFIX = "ytdl_gui"
+# The GUI has no command line, so it takes what cli's --trace, --metrics-file
+# and --metrics-port would say from these instead
+TRACE_ENV = "YTDL_GUI_TRACE"
+METRICS_FILE_ENV = "YTDL_GUI_METRICS_FILE"
+METRICS_PORT_ENV = "YTDL_GUI_METRICS_PORT"
+
+class RollingHistogram(object):
+    # The latest samples of something, plus running totals since startup
+    def __init__(self, window: int = HISTOGRAM_WINDOW):
+        self.samples: T.Deque[float] = collections.deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float) -> T.NoReturn:
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def quantile(self, q: float) -> T.Optional[float]:
+        if len(self.samples) == 0:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+class StageTimer(object):
+    # Handed out by Metrics.stage, and times whatever happens inside the
+    # with block. Set nbytes once they're known, and call fail() if the stage
+    # didn't work out without raising. retried can go straight to the
+    # fetcher as its on_retry.
+    def __init__(self, metrics: "Metrics", job_id: str, name: str):
+        self.metrics = metrics
+        self.job_id = job_id
+        self.name = name
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.seconds: T.Optional[float] = None
+        self.nbytes = 0
+        self.retries = 0
+        self.success = True
+        self._lock = threading.Lock()
+
+    def retried(self, err: T.Optional[BaseException] = None) -> T.NoReturn:
+        # Segmented downloads retry from several threads at once
+        with self._lock:
+            self.retries += 1
+
+    def fail(self) -> T.NoReturn:
+        self.success = False
+
+    def stop(self) -> T.NoReturn:
+        # For stages that don't fit in a with block. Only counts once.
+        if self.seconds is not None:
+            return
+        self.seconds = time.perf_counter() - self.started
+        self.metrics._record(self)
+
+    def __enter__(self) -> "StageTimer":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        if exc_type is not None:
+            self.success = False
+        self.stop()
+        return False
+
+class JobTrace(object):
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.started_at: T.Optional[float] = None
+        self.started: T.Optional[float] = None
+        self.stages: T.List[T.Dict[str, T.Any]] = []
+
+class Metrics(object):
+    # Shared by every download, and cheap enough to leave on. Nothing gets
+    # written anywhere until configure or serve says where.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._traces: T.Dict[str, JobTrace] = collections.OrderedDict()
+        self._durations: T.Dict[str, RollingHistogram] = {}
+        # MB/s, only for stages that moved bytes
+        self._throughput: T.Dict[str, RollingHistogram] = {}
+        self._stage_outcomes: T.Dict[T.Tuple[str, str], int] = {}
+        self._stage_bytes: T.Dict[str, int] = {}
+        self._stage_retries: T.Dict[str, int] = {}
+        self._job_outcomes: T.Dict[str, int] = {}
+        self._job_durations = RollingHistogram()
+        self._in_flight = 0
+
+        self.trace_path: T.Optional[str] = None
+        self.prometheus_path: T.Optional[str] = None
+        self._write_lock = threading.Lock()
+        self._server = None
+
+    def configure(self, trace_path: T.Optional[str] = None, prometheus_path: T.Optional[str] = None) -> T.NoReturn:
+        # trace_path gets a JSON line per finished job, prometheus_path is
+        # rewritten with the latest numbers whenever a job finishes
+        self.trace_path = trace_path
+        self.prometheus_path = prometheus_path
+
+    def configure_from_env(self) -> T.NoReturn:
+        self.configure(trace_path=os.environ.get(TRACE_ENV) or None, prometheus_path=os.environ.get(METRICS_FILE_ENV) or None)
+        port = os.environ.get(METRICS_PORT_ENV)
+        if not port:
+            return
+        try:
+            self.serve(int(port))
+        except (ValueError, OSError) as err:
+            print(f"WARNING: Couldn't serve metrics on port {port}: {err}", file=sys.stderr)
+
+    def _trace(self, job_id: str) -> JobTrace:
+        # Call with the lock held
+        trace = self._traces.get(job_id)
+        if trace is None:
+            trace = JobTrace(job_id)
+            self._traces[job_id] = trace
+            while len(self._traces) > MAX_OPEN_TRACES:
+                _, dropped = self._traces.popitem(last=False)
+                if dropped.started is not None:
+                    self._in_flight -= 1
+        return trace
+
+    def start_job(self, job_id: str) -> T.NoReturn:
+        # The download's been queued. Anything timed before this (the lookup)
+        # still counts towards it.
+        with self._lock:
+            trace = self._trace(job_id)
+            if trace.started is None:
+                self._in_flight += 1
+            trace.started_at = time.time()
+            trace.started = time.perf_counter()
+
+    def stage(self, job_id: str, name: str) -> StageTimer:
+        return StageTimer(self, job_id, name)
+
+    def _record(self, timer: StageTimer) -> T.NoReturn:
+        with self._lock:
+            self._durations.setdefault(timer.name, RollingHistogram()).add(timer.seconds)
+            if timer.nbytes > 0 and timer.seconds > 0:
+                self._throughput.setdefault(timer.name, RollingHistogram()).add(timer.nbytes / (1024 * 1024) / timer.seconds)
+            outcome = "success" if timer.success else "failed"
+            self._stage_outcomes[(timer.name, outcome)] = self._stage_outcomes.get((timer.name, outcome), 0) + 1
+            self._stage_bytes[timer.name] = self._stage_bytes.get(timer.name, 0) + timer.nbytes
+            self._stage_retries[timer.name] = self._stage_retries.get(timer.name, 0) + timer.retries
+            self._trace(timer.job_id).stages.append({
+                "stage": timer.name,
+                "started_at": timer.started_at,
+                "seconds": timer.seconds,
+                "bytes": timer.nbytes,
+                "retries": timer.retries,
+                "success": timer.success,
+            })
+
+    def finish_job(self, job_id: str, outcome: str, **fields: T.Any) -> T.NoReturn:
+        # outcome is success, failed, skipped or cancelled. fields (the video, profile
+        # etc.) go into the trace line as they are. Jobs that never started
+        # are just forgotten, as are ones that already finished.
+        with self._lock:
+            trace = self._traces.get(job_id)
+            if trace is None or trace.started is None:
+                self._traces.pop(job_id, None)
+                return
+            del self._traces[job_id]
+            self._in_flight -= 1
+            seconds = time.perf_counter() - trace.started
+            self._job_durations.add(seconds)
+            self._job_outcomes[outcome] = self._job_outcomes.get(outcome, 0) + 1
+
+        record = {"job": job_id, "outcome": outcome, "started_at": trace.started_at, "seconds": seconds}
+        record.update(fields)
+        record["bytes"] = sum(s["bytes"] for s in trace.stages)
+        record["retries"] = sum(s["retries"] for s in trace.stages)
+        record["stages"] = trace.stages
+        self._write_trace(record)
+        self.write_prometheus()
+
+    def _write_trace(self, record: T.Dict[str, T.Any]) -> T.NoReturn:
+        if self.trace_path is None:
+            return
+        try:
+            with self._write_lock:
+                with open(self.trace_path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+        except OSError as err:
+            print(f"WARNING: Couldn't write trace to {self.trace_path}: {err}", file=sys.stderr)
+
+    def prometheus_text(self) -> str:
+        lines = []
+        def header(name: str, kind: str, description: str):
+            lines.append(f"# HELP {METRIC_PREFIX}_{name} {description}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+
+        def summary(name: str, labels: str, histogram: RollingHistogram):
+            for q in QUANTILES:
+                value = histogram.quantile(q)
+                if value is not None:
+                    lines.append(f'{METRIC_PREFIX}_{name}{{{labels}quantile="{q}"}} {value:.6f}')
+            plain_labels = f"{{{labels.rstrip(',')}}}" if labels else ""
+            lines.append(f"{METRIC_PREFIX}_{name}_sum{plain_labels} {histogram.total:.6f}")
+            lines.append(f"{METRIC_PREFIX}_{name}_count{plain_labels} {histogram.count}")
+
+        with self._lock:
+            header("stage_seconds", "summary", f"Time spent in each stage of a download (quantiles over the last {HISTOGRAM_WINDOW})")
+            for each_stage, histogram in sorted(self._durations.items()):
+                summary("stage_seconds", f'stage="{each_stage}",', histogram)
+            header("stage_throughput_mb_per_second", "summary", f"MB/s through stages that move bytes (quantiles over the last {HISTOGRAM_WINDOW})")
+            for each_stage, histogram in sorted(self._throughput.items()):
+                summary("stage_throughput_mb_per_second", f'stage="{each_stage}",', histogram)
+            header("stage_total", "counter", "Stages run, by outcome")
+            for (each_stage, outcome), count in sorted(self._stage_outcomes.items()):
+                lines.append(f'{METRIC_PREFIX}_stage_total{{stage="{each_stage}",outcome="{outcome}"}} {count}')
+            header("stage_bytes_total", "counter", "Bytes moved by each stage")
+            for each_stage, nbytes in sorted(self._stage_bytes.items()):
+                lines.append(f'{METRIC_PREFIX}_stage_bytes_total{{stage="{each_stage}"}} {nbytes}')
+            header("stage_retries_total", "counter", "Retries within each stage")
+            for each_stage, retries in sorted(self._stage_retries.items()):
+                lines.append(f'{METRIC_PREFIX}_stage_retries_total{{stage="{each_stage}"}} {retries}')
+            header("job_seconds", "summary", f"Time from queueing a download to it finishing (quantiles over the last {HISTOGRAM_WINDOW})")
+            summary("job_seconds", "", self._job_durations)
+            header("jobs_total", "counter", "Finished downloads, by outcome")
+            for outcome, count in sorted(self._job_outcomes.items()):
+                lines.append(f'{METRIC_PREFIX}_jobs_total{{outcome="{outcome}"}} {count}')
+            header("jobs_in_flight", "gauge", "Downloads queued or running")
+            lines.append(f"{METRIC_PREFIX}_jobs_in_flight {self._in_flight}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self) -> T.NoReturn:
+        # For node_exporter's textfile collector and the like, so it has to be
+        # swapped in whole
+        if self.prometheus_path is None:
+            return
+        temp_path = f"{self.prometheus_path}.{threading.get_ident()}.temp"
+        try:
+            with open(temp_path, "w") as f:
+                f.write(self.prometheus_text())
+            os.replace(temp_path, self.prometheus_path)
+        except OSError as err:
+            print(f"WARNING: Couldn't write metrics to {self.prometheus_path}: {err}", file=sys.stderr)
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> int:
+        # Prometheus text on http://host:port/metrics, from a daemon thread.
+        # Returns the port, which is only interesting if port was 0.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        return self._server.server_address[1]
+
+metrics = Metrics()
@@ -0,0 +1,127 @@
+import threading
+
+import typing as T
+
+class JobProgress(object):
+    def __init__(self, total_bytes: int = 0):
+        self.total_bytes = total_bytes
+        self.done_bytes = 0
+        # KB/s, same as pafy
+        self.rate = 0.0
+        self.eta = 0.0
+        # False while it's still waiting in the download queue
+        self.started = False
+        self.finished = False
+        self.success: T.Optional[bool] = None
+
+    def fraction(self) -> float:
+        if self.finished:
+            return 1.0
+        if self.total_bytes <= 0:
+            return 0.0
+        return min(self.done_bytes / self.total_bytes, 1.0)
+
+class QueueProgress(object):
+    # running counts everything not finished yet, queued included
+    def __init__(self, total_bytes: int, done_bytes: int, rate: float, eta: float, running: int, queued: int, converting: int, finished: int, jobs: int, job_fractions: float):
+        self.total_bytes = total_bytes
+        self.done_bytes = done_bytes
+        self.rate = rate
+        self.eta = eta
+        self.running = running
+        self.queued = queued
+        self.converting = converting
+        self.finished = finished
+        self.jobs = jobs
+        self.job_fractions = job_fractions
+
+    def fraction(self) -> float:
+        # Every job counts the same, since queued ones don't know their size yet
+        if self.jobs <= 0:
+            return 0.0
+        return min(self.job_fractions / self.jobs, 1.0)
+
+class ProgressHub(object):
+    # Download threads write their latest numbers in here as often as they like.
+    # The UI reads it back at most once a frame, instead of getting a callback
+    # for every chunk.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: T.Dict[str, JobProgress] = {}
+        self._changed: T.Set[str] = set()
+
+    def queue(self, job_id: str) -> T.NoReturn:
+        # Counts towards the batch from when it's queued, not just once it starts
+        with self._lock:
+            if len(self._jobs) > 0 and all(p.finished for p in self._jobs.values()):
+                # Everything from the last batch is done, start counting afresh
+                self._jobs = {}
+            self._jobs[job_id] = JobProgress()
+            self._changed.add(job_id)
+
+    def start(self, job_id: str, total_bytes: int = 0) -> T.NoReturn:
+        with self._lock:
+            progress = JobProgress(total_bytes)
+            progress.started = True
+            self._jobs[job_id] = progress
+            self._changed.add(job_id)
+
+    def update(self, job_id: str, total_bytes: int, done_bytes: int, rate: float, eta: float) -> T.NoReturn:
+        with self._lock:
+            progress = self._jobs.get(job_id)
+            if progress is None:
+                progress = JobProgress(total_bytes)
+                self._jobs[job_id] = progress
+            progress.started = True
+            if total_bytes > 0:
+                progress.total_bytes = total_bytes
+            progress.done_bytes = done_bytes
+            progress.rate = rate
+            progress.eta = eta
+            self._changed.add(job_id)
+
+    def finish(self, job_id: str, success: bool) -> T.NoReturn:
+        with self._lock:
+            progress = self._jobs.get(job_id)
+            if progress is None:
+                progress = JobProgress()
+                self._jobs[job_id] = progress
+            progress.finished = True
+            progress.success = success
+            progress.rate = 0.0
+            progress.eta = 0.0
+            if progress.total_bytes > 0:
+                progress.done_bytes = progress.total_bytes
+            self._changed.add(job_id)
+
+    def remove(self, job_id: str) -> T.NoReturn:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._changed.add(job_id)
+
+    def get(self, job_id: str) -> T.Optional[JobProgress]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def take_changed(self) -> T.Set[str]:
+        # Jobs that changed since the last call
+        with self._lock:
+            changed = self._changed
+            self._changed = set()
+        return changed
+
+    def aggregate(self) -> QueueProgress:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        total_bytes = sum(p.total_bytes for p in jobs)
+        done_bytes = sum(p.done_bytes if not p.finished else p.total_bytes for p in jobs)
+        running = [p for p in jobs if not p.finished]
+        queued = len([p for p in running if not p.started])
+        rate = sum(p.rate for p in running)
+        # Weighted by bytes, so the ETA is for everything left that has a size
+        eta = ((total_bytes - done_bytes) / 1024.0) / rate if rate > 0 else 0.0
+        converting = len([p for p in running if p.total_bytes > 0 and p.done_bytes >= p.total_bytes])
+        job_fractions = sum(p.fraction() for p in jobs)
+        return QueueProgress(total_bytes, done_bytes, rate, eta, len(running), queued, converting, len(jobs) - len(running), len(jobs), job_fractions)
+
+progress_hub = ProgressHub()
@@ -0,0 +1,211 @@
+import os
+import threading
+import itertools
+import queue
+import sys
+import traceback
+
+import typing as T
+
+DEFAULT_PARALLEL_DOWNLOADS = 4
+
+CPU_COUNT = os.cpu_count() or 1
+# Conversions that run side by side. Each one gets a share of the cores (see
+# ffmpeg_threads), any more at once and they'd just fight over them.
+DEFAULT_PARALLEL_CONVERSIONS = max(1, CPU_COUNT // 2)
+
+class JobState(object):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    FINISHED = (DONE, FAILED, CANCELLED)
+
+class Job(object):
+    def __init__(self, target: T.Callable[[], T.Any], priority: int = 0, name: T.Optional[str] = None):
+        self.target = target
+        self.priority = priority
+        self.name = name
+
+        self.state = JobState.QUEUED
+        self.result = None
+        self.error: T.Optional[BaseException] = None
+
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._done_callbacks: T.List[T.Callable[["Job"], T.Any]] = []
+
+    def add_done_callback(self, callback: T.Callable[["Job"], T.Any]) -> T.NoReturn:
+        with self._lock:
+            if not self._finished.is_set():
+                self._done_callbacks.append(callback)
+                return
+        # Already finished, so call it right away
+        callback(self)
+
+    def is_finished(self) -> bool:
+        return self._finished.is_set()
+
+    def wait(self, timeout: T.Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+
+    def cancel(self) -> bool:
+        # Only jobs that haven't started yet can be cancelled
+        with self._lock:
+            if self.state != JobState.QUEUED:
+                return False
+            self.state = JobState.CANCELLED
+        self._finish()
+        return True
+
+    def _run(self) -> T.NoReturn:
+        with self._lock:
+            if self.state != JobState.QUEUED:
+                return
+            self.state = JobState.RUNNING
+        try:
+            self.result = self.target()
+        except BaseException as err:
+            print(f"Job {self.name} failed: {err}", file=sys.stderr)
+            traceback.print_exc()
+            self.error = err
+            self.state = JobState.FAILED
+        else:
+            self.state = JobState.DONE
+        self._finish()
+
+    def _finish(self) -> T.NoReturn:
+        with self._lock:
+            self._finished.set()
+            callbacks = self._done_callbacks
+            self._done_callbacks = []
+        for each_callback in callbacks:
+            # A broken listener mustn't take the worker thread down with it
+            try:
+                each_callback(self)
+            except Exception as err:
+                print(f"Job {self.name} done callback failed: {err}", file=sys.stderr)
+                traceback.print_exc()
+
+class Scheduler(object):
+    def __init__(self, max_workers: int, name: str = "worker"):
+        self.name = name
+        self._max_workers = max(1, max_workers)
+        self._nworkers = 0
+        self._lock = threading.Lock()
+
+        # Entries are (priority, sequence, job). Lower priorities run first, and
+        # the sequence number keeps equal priorities in FIFO order.
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._counter = itertools.count()
+
+    def max_workers(self) -> int:
+        return self._max_workers
+
+    def set_max_workers(self, max_workers: int) -> T.NoReturn:
+        with self._lock:
+            self._max_workers = max(1, max_workers)
+            extra = self._nworkers - self._max_workers
+        # Shrinking: wake up idle workers and tell them to stop. Busy workers
+        # pick the stop request up once their current job is done.
+        for _ in range(max(0, extra)):
+            self._queue.put((float("-inf"), next(self._counter), None))
+        self._spawn_workers()
+
+    def submit(self, target: T.Callable[[], T.Any], priority: int = 0, name: T.Optional[str] = None) -> Job:
+        job = Job(target, priority=priority, name=name)
+        self._queue.put((priority, next(self._counter), job))
+        self._spawn_workers()
+        return job
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _spawn_workers(self) -> T.NoReturn:
+        with self._lock:
+            while self._nworkers < self._max_workers:
+                self._nworkers += 1
+                worker = threading.Thread(target=self._work, name=f"{self.name}-{self._nworkers}", daemon=True)
+                worker.start()
+
+    def _work(self) -> T.NoReturn:
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                with self._lock:
+                    if self._nworkers > self._max_workers:
+                        self._nworkers -= 1
+                        return
+                # Somebody grew the pool again in the meantime
+                continue
+            try:
+                job._run()
+            except BaseException as err:
+                # _run already catches the job's own errors, this is a last resort
+                # so the pool never quietly loses a worker
+                print(f"Worker {threading.current_thread().name} hit an error: {err}", file=sys.stderr)
+                traceback.print_exc()
+
+class Slots(object):
+    # A counting semaphore that can be resized while in use
+    def __init__(self, count: int):
+        self._count = max(1, count)
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def set_count(self, count: int) -> T.NoReturn:
+        with self._cond:
+            self._count = max(1, count)
+            self._cond.notify_all()
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self._used >= self._count:
+                return False
+            self._used += 1
+            return True
+
+    def acquire(self) -> T.NoReturn:
+        with self._cond:
+            while self._used >= self._count:
+                self._cond.wait()
+            self._used += 1
+
+    def release(self) -> T.NoReturn:
+        with self._cond:
+            self._used -= 1
+            self._cond.notify()
+
+    def __enter__(self) -> "Slots":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        self.release()
+        return False
+
+# Shared pool that all DownloadEntry downloads go through
+download_scheduler = Scheduler(DEFAULT_PARALLEL_DOWNLOADS, name="download")
+
+# Small jobs that have to stay off the UI thread (playlist listing, lookups...)
+background_scheduler = Scheduler(4, name="background")
+
+# ffmpeg runs on finished downloads go here, so the download workers can get
+# on with the next one
+conversion_scheduler = Scheduler(DEFAULT_PARALLEL_CONVERSIONS, name="conversion")
+# Every ffmpeg run holds one of these, including the ones streaming inside a
+# download worker, so there are never more than the conversion pool's size
+conversion_slots = Slots(DEFAULT_PARALLEL_CONVERSIONS)
+
+def set_parallel_downloads(n: int) -> T.NoReturn:
+    download_scheduler.set_max_workers(n)
+
+def set_parallel_conversions(n: int) -> T.NoReturn:
+    conversion_scheduler.set_max_workers(n)
+    conversion_slots.set_count(n)
+
+def ffmpeg_threads() -> int:
+    # Threads for each ffmpeg, so that a full conversion pool adds up to the whole machine
+    return max(1, CPU_COUNT // conversion_scheduler.max_workers())
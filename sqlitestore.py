@@ -0,0 +1,52 @@
+import os
+import sqlite3
+import threading
+
+import typing as T
+
+class SQLiteStore(object):
+    # Statements run once when the database is first opened
+    SCHEMA: T.List[str] = []
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn: T.Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened lazily so that importing doesn't touch the disk
+        if self._conn is None:
+            parent = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(parent, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            # WAL lets readers carry on while a writer commits
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for each_statement in self.SCHEMA:
+                conn.execute(each_statement)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def query(self, sql: str, params: T.Sequence[T.Any] = ()) -> T.List[tuple]:
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+
+    def execute(self, sql: str, params: T.Sequence[T.Any] = ()) -> int:
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor.rowcount
+
+    def executemany(self, sql: str, param_rows: T.Iterable[T.Sequence[T.Any]]) -> T.NoReturn:
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(sql, param_rows)
+            conn.commit()
+
+    def close(self) -> T.NoReturn:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
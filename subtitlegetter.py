@@ -1,35 +1,85 @@
 import typing as T
-import youtube_dl
 import os
 import sys
+import threading
 
-def download_subtitles(link: str, fname: str, lang: str = "en"):
-    fname = os.path.abspath(fname)
-    outpath = os.path.splitext(fname)[0]
-
-    postprocessors = []
-    postprocessors.append(
-        {
-            'key': 'FFmpegSubtitlesConvertor',
-            'format': 'vtt'
-        }
-    )
-    yt_params = {
-        'writesubtitles': True,
-        'subtitleslangs': [lang],
-        'skip_download': True,
-        'postprocessors': postprocessors,
-        'outtmpl': outpath + '.%(ext)s'
-    }
+DEFAULT_SUBTITLE_LANGUAGES = ["en"]
 
+class SubtitleFetcher(object):
+    # One YoutubeDL for every download, instead of a new one (and a fresh
+    # look at the video page) per subtitle. It isn't safe to share between
+    # threads, so page extractions take turns. Each one gets every
+    # language that's wanted, and the files themselves are fetched after the
+    # lock is let go.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._downloader = None
+
+    def _get_downloader(self):
+        if self._downloader is None:
+            import youtube_dl
+            self._downloader = youtube_dl.YoutubeDL(params={
+                'skip_download': True,
+                'quiet': True,
+                'no_warnings': True,
+            })
+        return self._downloader
+
+    def fetch(self, link: str, fname: str, langs: T.Sequence[str] = DEFAULT_SUBTITLE_LANGUAGES) -> T.Dict[str, str]:
+        # Saves fname-without-extension.<lang>.vtt for each language that
+        # exists, and returns {lang: path} for those
+        outpath = os.path.splitext(os.path.abspath(fname))[0]
+        with self._lock:
+            info = self._get_downloader().extract_info(link, download=False)
+        available = info.get('subtitles') or {}
+
+        saved = {}
+        for each_lang in langs:
+            formats = available.get(each_lang)
+            if not formats:
+                print(f"WARNING: No {each_lang} subtitles for {link}", file=sys.stderr)
+                continue
+            vtt_formats = [f for f in formats if f.get('ext') == 'vtt']
+            chosen = vtt_formats[0] if len(vtt_formats) > 0 else formats[0]
+            lang_path = f"{outpath}.{each_lang}.vtt"
+            try:
+                self._save(chosen['url'], chosen.get('ext'), lang_path)
+            except Exception as err:
+                print(f"WARNING: Couldn't save {each_lang} subtitles: {err}", file=sys.stderr)
+                continue
+            saved[each_lang] = lang_path
+        return saved
+
+    def _save(self, url: str, ext: T.Optional[str], path: str) -> T.NoReturn:
+        import requests
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        if ext == 'vtt':
+            with open(path, "wb") as f:
+                f.write(response.content)
+            return
+
+        # Some other format, have ffmpeg turn it into vtt
+        import ffmpeg
+        raw_path = f"{os.path.splitext(path)[0]}.{ext or 'sub'}"
+        with open(raw_path, "wb") as f:
+            f.write(response.content)
+        try:
+            ffmpeg.input(raw_path).output(path).global_args("-y", "-loglevel", "error").run(quiet=True)
+        finally:
+            os.remove(raw_path)
+
+subtitle_fetcher = SubtitleFetcher()
+
+def download_subtitles(link: str, fname: str, langs: T.Sequence[str] = DEFAULT_SUBTITLE_LANGUAGES) -> T.Optional[str]:
+    # Path to the first language's subtitles, or None if there aren't any
     try:
-        with youtube_dl.YoutubeDL(params=yt_params) as downloader:
-            downloader.download([link])
+        saved = subtitle_fetcher.fetch(link, fname, langs)
     except Exception as exc:
-        print("WARNING: Subtitle download failed.", file=sys.stderr)    
-    
-    return outpath + ".en.vtt"
-    
+        print(f"WARNING: Subtitle download failed: {exc}", file=sys.stderr)
+        return None
 
-if __name__ == '__main__':
-    test_download()
\ No newline at end of file
+    for each_lang in langs:
+        if each_lang in saved:
+            return saved[each_lang]
+    return None
@@ -1,9 +1,82 @@
-from mutagen.easyid3 import EasyID3 as id3
+import base64
+import os
+import sys
 
-def tag_file(mp3_path, title = None, artist = None):
-    mp3_file = id3(mp3_path)
+import typing as T
+
+# Tags files after the fact. Anything that goes through ffmpeg gets its tags
+# written during the conversion instead (see converter), this is for files
+# that never did (converter.ConversionPath.NONE).
+
+def tag_file(path: str, title: T.Optional[str] = None, artist: T.Optional[str] = None, source_url: T.Optional[str] = None, video_id: T.Optional[str] = None, cover_art: T.Optional[str] = None):
+    taggers = {
+        ".mp3": _tag_mp3,
+        ".m4a": _tag_mp4,
+        ".mp4": _tag_mp4,
+        ".opus": _tag_ogg,
+        ".ogg": _tag_ogg,
+    }
+    tagger = taggers.get(os.path.splitext(path)[1].lower())
+    if tagger is None:
+        print(f"WARNING: Don't know how to tag {path}", file=sys.stderr)
+        return
+
+    cover = None
+    if cover_art is not None:
+        with open(cover_art, "rb") as f:
+            cover = f.read()
+    tagger(path, title, artist, source_url, video_id, cover)
+
+def _tag_mp3(path, title, artist, source_url, video_id, cover):
+    from mutagen.id3 import ID3, ID3NoHeaderError, TIT2, TPE1, COMM, TXXX, APIC
+    try:
+        tags = ID3(path)
+    except ID3NoHeaderError:
+        tags = ID3()
+    if title is not None:
+        tags.setall("TIT2", [TIT2(encoding=3, text=title)])
+    if artist is not None:
+        tags.setall("TPE1", [TPE1(encoding=3, text=artist)])
+    if source_url is not None:
+        tags.setall("COMM", [COMM(encoding=3, lang="eng", desc="", text=source_url)])
+    if video_id is not None:
+        tags.setall("TXXX:video_id", [TXXX(encoding=3, desc="video_id", text=video_id)])
+    if cover is not None:
+        tags.setall("APIC", [APIC(encoding=3, mime="image/jpeg", type=3, desc="Cover", data=cover)])
+    # Same version converter has ffmpeg write, it's what most players read
+    tags.save(path, v2_version=3)
+
+def _tag_mp4(path, title, artist, source_url, video_id, cover):
+    from mutagen.mp4 import MP4, MP4Cover
+    mp4_file = MP4(path)
+    if title is not None:
+        mp4_file["\xa9nam"] = [title]
+    if artist is not None:
+        mp4_file["\xa9ART"] = [artist]
+    if source_url is not None:
+        mp4_file["\xa9cmt"] = [source_url]
+    if video_id is not None:
+        mp4_file["----:com.apple.iTunes:video_id"] = [video_id.encode("utf-8")]
+    if cover is not None:
+        mp4_file["covr"] = [MP4Cover(cover, imageformat=MP4Cover.FORMAT_JPEG)]
+    mp4_file.save()
+
+def _tag_ogg(path, title, artist, source_url, video_id, cover):
+    import mutagen
+    from mutagen.flac import Picture
+    ogg_file = mutagen.File(path)
     if title is not None:
-        mp3_file["title"] = title
+        ogg_file["title"] = [title]
     if artist is not None:
-        mp3_file["artist"] = artist
-    mp3_file.save()
+        ogg_file["artist"] = [artist]
+    if source_url is not None:
+        ogg_file["comment"] = [source_url]
+    if video_id is not None:
+        ogg_file["video_id"] = [video_id]
+    if cover is not None:
+        picture = Picture()
+        picture.type = 3
+        picture.mime = "image/jpeg"
+        picture.data = cover
+        ogg_file["metadata_block_picture"] = [base64.b64encode(picture.write()).decode("ascii")]
+    ogg_file.save()
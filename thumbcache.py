@@ -0,0 +1,193 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+
+import typing as T
+
+from . import DEFAULT_THUMBNAIL_DIR
+from .sqlitestore import SQLiteStore
+from .scheduler import background_scheduler
+
+# Sizes each thumbnail gets stored at, (width, height). Rows are tiny, the
+# detail pane is the biggest anything is ever shown.
+THUMBNAIL_VARIANTS = {
+    "row": (192, 108),
+    "detail": (640, 360),
+}
+# Least recently used images (and their variants) get deleted past this many
+MAX_CACHED_THUMBNAILS = 5000
+
+ThumbnailCallback = T.Callable[[T.Optional[str]], T.Any]
+
+class ThumbnailCache(SQLiteStore):
+    # Thumbnails on disk, keyed by what's in them rather than where they came
+    # from, so the same picture behind different URLs is only stored once.
+    # Each one is kept downscaled to every variant, which is all the UI loads.
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS thumbnail_urls (
+            url TEXT PRIMARY KEY,
+            content_hash TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS thumbnails (
+            content_hash TEXT PRIMARY KEY,
+            extension TEXT,
+            last_used REAL
+        )""",
+        "CREATE INDEX IF NOT EXISTS thumbnails_last_used ON thumbnails (last_used)",
+    ]
+
+    def __init__(self, directory: str, max_thumbnails: int = MAX_CACHED_THUMBNAILS):
+        super().__init__(os.path.join(directory, "thumbnails.sqlite"))
+        self.directory = directory
+        self.max_thumbnails = max_thumbnails
+        # (url, variant) -> path, so the UI thread can ask without touching the database
+        self._known: T.Dict[T.Tuple[str, str], str] = {}
+        # (url, variant) -> callbacks waiting on a fetch that's already underway
+        self._waiting: T.Dict[T.Tuple[str, str], T.List[ThumbnailCallback]] = {}
+        self._waiting_lock = threading.Lock()
+
+    def _original_path(self, content_hash: str, extension: str) -> str:
+        return os.path.join(self.directory, content_hash[:2], f"{content_hash}{extension}")
+
+    def _variant_path(self, content_hash: str, variant: str) -> str:
+        return os.path.join(self.directory, content_hash[:2], f"{content_hash}_{variant}.jpg")
+
+    def cached(self, url: str, variant: str) -> T.Optional[str]:
+        # Only what's already known in memory, never blocks
+        return self._known.get((url, variant))
+
+    def get(self, url: str, variant: str) -> T.Optional[str]:
+        # Path to the variant, downloading and downscaling first if need be.
+        # Blocks, so keep it off the UI thread.
+        path = self._known.get((url, variant))
+        if path is not None and os.path.isfile(path):
+            return path
+
+        if os.path.isfile(url):
+            # Local images (placeholders, icons) are already small enough
+            self._known[(url, variant)] = url
+            return url
+
+        content_hash = None
+        rows = self.query("SELECT t.content_hash, t.extension FROM thumbnail_urls u JOIN thumbnails t ON u.content_hash = t.content_hash WHERE u.url = ?", (url,))
+        if len(rows) > 0:
+            content_hash, extension = rows[0]
+            if not os.path.isfile(self._original_path(content_hash, extension)):
+                content_hash = None
+        if content_hash is None:
+            content_hash, extension = self._fetch(url)
+            if content_hash is None:
+                return None
+
+        self.execute("UPDATE thumbnails SET last_used = ? WHERE content_hash = ?", (time.time(), content_hash))
+        path = self._variant_path(content_hash, variant)
+        if not os.path.isfile(path):
+            path = self._downscale(self._original_path(content_hash, extension), path, THUMBNAIL_VARIANTS[variant])
+        self._known[(url, variant)] = path
+        return path
+
+    def request(self, url: str, variant: str, callback: ThumbnailCallback) -> T.NoReturn:
+        # Same as get, but in the background. callback gets the path (or None)
+        # on a worker thread. Asking for something that's already on its way
+        # just waits for that instead of fetching it twice.
+        path = self.cached(url, variant)
+        if path is not None:
+            callback(path)
+            return
+
+        key = (url, variant)
+        with self._waiting_lock:
+            if key in self._waiting:
+                self._waiting[key].append(callback)
+                return
+            self._waiting[key] = [callback]
+
+        def fetch():
+            try:
+                path = self.get(url, variant)
+            except Exception as err:
+                print(f"WARNING: Couldn't get thumbnail {url}: {err}", file=sys.stderr)
+                path = None
+            with self._waiting_lock:
+                callbacks = self._waiting.pop(key, [])
+            for each_callback in callbacks:
+                each_callback(path)
+
+        # Ahead of other background work, someone's looking at this
+        background_scheduler.submit(fetch, priority=-1, name=f"thumbnail {url}")
+
+    def _fetch(self, url: str) -> T.Tuple[T.Optional[str], T.Optional[str]]:
+        import requests
+        try:
+            response = requests.get(url, timeout=30)
+            response.raise_for_status()
+        except requests.RequestException as err:
+            print(f"WARNING: Couldn't download thumbnail {url}: {err}", file=sys.stderr)
+            return None, None
+
+        content = response.content
+        content_hash = hashlib.sha1(content).hexdigest()
+        extension = os.path.splitext(url.split("?")[0])[1].lower() or ".jpg"
+        path = self._original_path(content_hash, extension)
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Per thread, two downloads can want the same picture at once
+            temp_path = f"{path}.{threading.get_ident()}.temp"
+            with open(temp_path, "wb") as f:
+                f.write(content)
+            os.replace(temp_path, path)
+
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("INSERT OR IGNORE INTO thumbnails (content_hash, extension, last_used) VALUES (?, ?, ?)", (content_hash, extension, now))
+            conn.execute("INSERT OR REPLACE INTO thumbnail_urls (url, content_hash) VALUES (?, ?)", (url, content_hash))
+            conn.commit()
+        self.evict()
+        return content_hash, extension
+
+    def _downscale(self, original_path: str, path: str, size: T.Tuple[int, int]) -> str:
+        # Fits the image inside size, keeping its aspect ratio. If ffmpeg isn't
+        # up to it, the original will have to do.
+        import ffmpeg
+        width, height = size
+        temp_path = f"{path}.{threading.get_ident()}.temp.jpg"
+        try:
+            (
+                ffmpeg
+                .input(original_path)
+                .filter("scale", width, height, force_original_aspect_ratio="decrease")
+                .output(temp_path, vframes=1)
+                .global_args("-y", "-loglevel", "error")
+                .run(quiet=True)
+            )
+            os.replace(temp_path, path)
+            return path
+        except Exception as err:
+            print(f"WARNING: Couldn't downscale {original_path}: {err}", file=sys.stderr)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return original_path
+
+    def evict(self) -> T.NoReturn:
+        count = self.query("SELECT COUNT(*) FROM thumbnails")[0][0]
+        extra = count - self.max_thumbnails
+        if extra <= 0:
+            return
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute("SELECT content_hash, extension FROM thumbnails ORDER BY last_used ASC LIMIT ?", (extra,)).fetchall()
+            hashes = [(h,) for h, _ in rows]
+            conn.executemany("DELETE FROM thumbnail_urls WHERE content_hash = ?", hashes)
+            conn.executemany("DELETE FROM thumbnails WHERE content_hash = ?", hashes)
+            conn.commit()
+        stale = set(h for h, _ in rows)
+        self._known = {k: v for k, v in self._known.items() if not any(os.path.basename(v).startswith(h) for h in stale)}
+        for content_hash, extension in rows:
+            for each_path in [self._original_path(content_hash, extension)] + [self._variant_path(content_hash, v) for v in THUMBNAIL_VARIANTS]:
+                if os.path.exists(each_path):
+                    os.remove(each_path)
+
+thumbnail_cache = ThumbnailCache(DEFAULT_THUMBNAIL_DIR)
@@ -4,8 +4,10 @@ from kivy.clock import Clock
 from kivy.uix.widget import Widget
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.progressbar import ProgressBar
-from kivy.uix.scrollview import ScrollView
-from kivy.uix.image import Image, AsyncImage
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.image import Image
 from kivy.core.image import Image as RawImage
 from kivy.uix.button import Button
 from kivy.uix.togglebutton import ToggleButton
@@ -14,12 +16,20 @@ from kivy.uix.label import Label
 from kivy.uix.textinput import TextInput
 from kivy.graphics import Rectangle, Color as IColor, InstructionGroup
 from kivy.resources import resource_find
-from kivy.properties import NumericProperty, BooleanProperty, StringProperty
+from kivy.properties import NumericProperty, BooleanProperty, StringProperty, ObjectProperty
 from kivy.effects.scroll import ScrollEffect
 
 import os
+import sys
+import threading
 import typing as T
-from .dlmanager import DownloadEntry, extract_url_ids, playlist_items
+from collections import OrderedDict
+from .dlmanager import DownloadEntry, ResolveState, extract_url_ids, iter_playlist_pages, videos_metadata
+from .scheduler import background_scheduler
+from .progresshub import progress_hub
+from .jobstore import job_store
+from .thumbcache import thumbnail_cache
+from .metrics import metrics
 
 import random
 
@@ -36,6 +46,76 @@ ICON_DOWNLOAD = resource_find("icon_download.png")
 
 
 
+def format_eta(total_seconds: float) -> str:
+    total_seconds = int(total_seconds)
+    nhours = total_seconds // 3600
+    nminutes = (total_seconds // 60) % 60
+    nseconds = total_seconds % 60
+    if nhours > 0:
+        return "%dhr %02dm" % (nhours, nminutes)
+    elif nminutes > 0:
+        return "%dm %02ds" % (nminutes, nseconds)
+    else:
+        return "%ds" % (nseconds,)
+
+def format_rate(kb_per_second: float) -> str:
+    if kb_per_second >= 1024:
+        return "%.1f MB/s" % (kb_per_second / 1024.0,)
+    return "%d KB/s" % (kb_per_second,)
+
+# Decoded images kept in memory at most. Rows get recycled, so this stays
+# flat however long the queue is.
+MAX_CACHED_TEXTURES = 256
+
+class TextureCache(object):
+    # Textures by image path, least recently used dropped first
+    def __init__(self, max_textures: int = MAX_CACHED_TEXTURES):
+        self.max_textures = max_textures
+        self._textures = OrderedDict()
+
+    def get(self, path: str):
+        texture = self._textures.get(path)
+        if texture is not None:
+            self._textures.move_to_end(path)
+            return texture
+        texture = RawImage(path).texture
+        self._textures[path] = texture
+        if len(self._textures) > self.max_textures:
+            self._textures.popitem(last=False)
+        return texture
+
+texture_cache = TextureCache()
+# The bundled icons, kept apart so thumbnails never push them out. Every
+# ImageButton shares these, swapping icons doesn't touch the disk.
+icon_cache = TextureCache()
+
+class Thumbnail(Image):
+    # Shows one of thumbnail_cache's downscaled variants. Can be pointed at
+    # something else any time, a fetch that comes back late is ignored.
+    def __init__(self, variant: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.variant = variant
+        self.wanted = None
+        self.show(PLACEHOLDER_IMG)
+
+    def show(self, url: str):
+        if url == self.wanted:
+            return
+        self.wanted = url
+        path = thumbnail_cache.cached(url, self.variant)
+        if path is None and os.path.isfile(url):
+            path = url
+        if path is not None:
+            self.texture = texture_cache.get(path)
+            return
+        self.texture = texture_cache.get(PLACEHOLDER_IMG)
+        thumbnail_cache.request(url, self.variant, lambda path: Clock.schedule_once(lambda dt: self.on_fetched(url, path)))
+
+    def on_fetched(self, url: str, path: T.Optional[str]):
+        if url != self.wanted or path is None:
+            return
+        self.texture = texture_cache.get(path)
+
 class Placeholder(Image):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, source=PLACEHOLDER_IMG, **kwargs)
@@ -45,7 +125,7 @@ class ImageButton(Button):
 
     def __init__(self, source=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.img = None
+        self.icon_texture = None
         self.rect = Rectangle(pos=(0,0), size=(1,1), texture=None)
         self.bind(source=self.refresh_rect, size=self.resize_rect, pos=self.resize_rect)
 
@@ -68,13 +148,13 @@ class ImageButton(Button):
         mysize = tuple(map(int, self.size))
 
         # We want to maintain aspect ratio
-        wmult = mysize[0]*0.9 / max(self.img.width, 1)
-        hmult = mysize[1]*0.9 / max(self.img.height, 1)
+        wmult = mysize[0]*0.9 / max(self.icon_texture.width, 1)
+        hmult = mysize[1]*0.9 / max(self.icon_texture.height, 1)
 
         bettermult = min(wmult, hmult)
 
-        outw = int(self.img.width * bettermult)
-        outh = int(self.img.height * bettermult)
+        outw = int(self.icon_texture.width * bettermult)
+        outh = int(self.icon_texture.height * bettermult)
 
         paddingw = (mysize[0] - outw) // 2
         paddingh = (mysize[1] - outh) // 2
@@ -83,9 +163,14 @@ class ImageButton(Button):
         self.rect.size = (outw, outh)
 
     def refresh_rect(self, *args):
-        assert resource_find(self.source) is not None
-        self.img = RawImage(str(self.source))
-        self.rect.texture = self.img.texture
+        texture = icon_cache.get(str(self.source))
+        if texture is self.icon_texture:
+            return
+        previous = self.icon_texture
+        self.icon_texture = texture
+        self.rect.texture = texture
+        if previous is not None and previous.size != texture.size:
+            self.resize_rect()
         
 
 
@@ -130,12 +215,19 @@ class YTDLQueueControls(BoxLayout):
     def submit_playlist(self, *args):
         v_id, pl_id = self.get_entered_ids()
         if pl_id is not None:
-            items = playlist_items(pl_id)
-            if items is not None:
-                # Valid playlist
-                for each_video in items:
-                    self.ui_root.dl_queue.add_new_download(url=each_video)
-                self.url_input.text = ""
+            # Listing a big playlist takes a while, so do it in the background
+            # and add each page to the queue as it shows up
+            background_scheduler.submit(lambda: self._load_playlist(pl_id), name=f"playlist-{pl_id}")
+            self.url_input.text = ""
+
+    def _load_playlist(self, pl_id: str):
+        for each_page in iter_playlist_pages(pl_id):
+            # One API call for the whole page, instead of a pafy lookup per video
+            metas = videos_metadata(each_page)
+            Clock.schedule_once(lambda dt, page=each_page, metas=metas: self._add_playlist_page(page, metas))
+
+    def _add_playlist_page(self, page: T.List[str], metas):
+        self.ui_root.dl_queue.add_new_downloads(page, metas)
     
     def submit_playlist_or_video(self, *args):
         v_id, pl_id = self.get_entered_ids()
@@ -147,20 +239,16 @@ class YTDLQueueControls(BoxLayout):
             # Do nothing
             pass
     
-class YTDLQueueEntry(BoxLayout):
-    download_progress = NumericProperty(0.0)
-    done = BooleanProperty(False)
-    conversion_success = BooleanProperty(True)
+class YTDLQueueEntry(RecycleDataViewBehavior, BoxLayout):
+    # One visible row of the queue. Rows get recycled as the queue scrolls,
+    # so everything about the download itself lives on the DownloadEntry.
+    info = ObjectProperty(None, allownone=True)
 
-    def __init__(self, ui_root, url=None, *args, **kwargs):
+    def __init__(self, *args, **kwargs):
         super().__init__(*args, orientation='horizontal', **kwargs)
-        self.ui_root = ui_root
+        self.ui_root = None
 
-        self.info = DownloadEntry()
-        self.info.set_url(url)
-        self.info.bind(progress=self.dl_on_progress, done=self.dl_on_done)
-
-        self.thumbnail = AsyncImage(source=PLACEHOLDER_IMG, size_hint=(0.1, 1.0), allow_stretch=True)
+        self.thumbnail = Thumbnail("row", size_hint=(0.1, 1.0), allow_stretch=True)
         self.description = Label(text="URL Needed", size_hint=(0.6, 1.0))
         self.description.font_size = 20
         self.description.text_size = self.description.size
@@ -175,11 +263,23 @@ class YTDLQueueEntry(BoxLayout):
         self.add_widget(self.description)
         self.add_widget(self.remove_from_queue)
 
+    def refresh_view_attrs(self, rv, index, data):
+        # Called whenever this row gets (re)bound to a queue entry
+        self.ui_root = rv.ui_root
+        rv.track_row(self, data["info"])
+        super().refresh_view_attrs(rv, index, data)
         self.refresh_from_info()
-        self.bind(done=self.refresh_from_info)
+
+    def finished(self) -> bool:
+        return self.info.is_done
+
+    def conversion_success(self) -> bool:
+        return self.info.success is not False
 
     def on_dl_or_reveal_pressed(self, *args):
-        if self.info.is_revealable() and self.conversion_success and self.done:
+        if self.info is None:
+            return
+        if self.info.is_revealable() and self.conversion_success() and self.finished():
             self.on_reveal_pressed()
         elif self.info.is_downloadable():
             self.on_dl_pressed()
@@ -189,13 +289,13 @@ class YTDLQueueEntry(BoxLayout):
 
         which_icon = None
 
-        if self.info.is_revealable() and self.conversion_success and self.done:
+        if self.info.is_revealable() and self.conversion_success() and self.finished():
             which_icon = self.reveal_icon
         elif self.info.is_downloadable():
             which_icon = self.download_icon
-        elif not self.conversion_success:
+        elif not self.conversion_success() or self.info.resolve_state == ResolveState.FAILED:
             which_icon = ICON_WARNING
-        elif self.done and self.conversion_success:
+        elif self.finished() and self.conversion_success():
             # It's SUPPOSED to be done and converted, but we still can't see it
             which_icon = ICON_WARNING
         else:
@@ -209,40 +309,32 @@ class YTDLQueueEntry(BoxLayout):
                 self.add_widget(self.download_or_reveal)
             self.download_or_reveal.source = which_icon
 
-    def _dl_on_progress(self, amount: float):
-        self.download_progress = amount
-
-    def dl_on_progress(self, amount: float):
-        Clock.schedule_once(lambda dt: self._dl_on_progress(amount))
-    
-    def _dl_on_done(self, success: bool):
-        self.done = True
-        self.conversion_success = success
-        self.ui_root.refresh()
-
-    def dl_on_done(self, success: bool):
-        Clock.schedule_once(lambda dt: self._dl_on_done(success))
-
     def on_dl_pressed(self, *args):
         self.ui_root.details.update_info()
         self.info.download()
-        self.ui_root.refresh()
     
     def on_remove_pressed(self, *args):
-        self.ui_root.remove_queue_entry(self)
+        if self.info is None:
+            return
+        # Queued downloads get pulled out of the scheduler too. One that
+        # started in the meantime has to stay, is_forgettable turns the
+        # button back off on the next refresh.
+        if self.info.download_job is not None and not self.info.is_done and not self.info.cancel():
+            return
+        self.ui_root.remove_queue_entry(self.info)
 
     def on_reveal_pressed(self, *args):
         self.info.reveal_in_explorer()
 
     def on_touch_up(self, touch):
-        if ((
+        if self.info is not None and ((
                 self.thumbnail.collide_point(*touch.pos) or 
                 self.description.collide_point(*touch.pos)
             ) and not (
                 self.download_or_reveal.collide_point(*touch.pos) or
                 self.remove_from_queue.collide_point(*touch.pos)
             )):
-            self.ui_root.select_entry(self)
+            self.ui_root.select_entry(self.info)
             return True
         else:
             return False
@@ -251,21 +343,37 @@ class YTDLQueueEntry(BoxLayout):
         self.description.text_size=self.description.size
 
     def refresh_from_info(self, *args):
+        if self.info is None:
+            return
         if self.info.valid():
             if self.info.audio_only:
-                self.thumbnail.source = ICON_MUSIC
+                self.thumbnail.show(ICON_MUSIC)
             else:
-                self.thumbnail.source = self.info.vthumbnail()
+                self.thumbnail.show(self.info.vthumbnail())
         else:
-            self.thumbnail.source = PLACEHOLDER_IMG
-        desctext = f"{self.info.otitle()} ({self.info.vformattedduration()})"
+            self.thumbnail.show(PLACEHOLDER_IMG)
+        self.refresh_description()
+        if self.ui_root.selected is self.info:
+            self.select()
+        else:
+            self.deselect()
+        self.refresh_buttons()
+
+    def refresh_description(self):
+        if self.info is None:
+            return
+        if self.info.resolve_state == ResolveState.RESOLVING:
+            desctext = f"Resolving {self.info.url}..."
+        elif self.info.resolve_state == ResolveState.FAILED:
+            desctext = f"Lookup failed: {self.info.url}"
+        else:
+            desctext = f"{self.info.otitle()} ({self.info.vformattedduration()})"
+            progress = progress_hub.get(self.info.id)
+            if progress is not None and progress.started and not progress.finished:
+                desctext = f"{desctext} - {int(progress.fraction() * 100)}%"
         if len(desctext) == 0:
             desctext = "NEEDS INFO"
         self.description.text = desctext
-        self.refresh_buttons()
-
-    def set_get_subtitles(self, new_get_subtitles: bool):
-        self.info.set_download_subtitles(new_get_subtitles)
 
     def select(self):
         self.description.color = (0.7, 0.7, 1.0, 1.0)
@@ -275,88 +383,202 @@ class YTDLQueueEntry(BoxLayout):
         self.description.color = (1.0, 1.0, 1.0, 1.0)
         self.description.bold = False
 
-class YTDLDownloadQueueContents(BoxLayout):
+class YTDLDownloadQueueContents(RecycleBoxLayout):
     per_entry_height = NumericProperty(40)
 
-    def __init__(self, ui_root, *args, **kwargs):
-        super().__init__(*args, orientation='vertical', **kwargs)
-        self.ui_root = ui_root
-        self.entries = []
-
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, orientation='vertical', default_size_hint=(1.0, None), **kwargs)
+        self.bind(minimum_height=self.setter('height'))
         self.bind(per_entry_height=self.change_all_heights)
         self.change_all_heights(self, self.per_entry_height)
 
-    def refresh_all(self):
-        for entry in self.entries:
-            entry.refresh_from_info()
-
-
     def change_all_heights(self, inst, val):
-        for entry in self.entries:
-            entry.height = self.per_entry_height
-        self.height = self.per_entry_height * len(self.entries)
-
-    def add_new_download(self, url=None):
-        new_entry = YTDLQueueEntry(self.ui_root, url=url, size_hint=(1.0, None))
-        self.entries.append(new_entry)
-        self.add_widget(new_entry)
-        self.change_all_heights(self, self.per_entry_height)
-        return new_entry
-    
-    def remove_queue_entry(self, wdg):
-        if wdg in self.entries:
-            self.entries.remove(wdg)
-            self.remove_widget(wdg)
-            self.change_all_heights(self, self.per_entry_height)
-        self.refresh_all()
-
-    def get_first_download(self) -> T.Optional[YTDLQueueEntry]:
-        for each_entry in self.entries:
-            if each_entry.info.is_downloadable():
-                return each_entry
-        else:
-            return None
-    
-    def sync_all_get_subtitles(self, new_get_subtitles: bool):
-        for each_entry in self.entries:
-            each_entry.set_get_subtitles(new_get_subtitles)
+        self.default_size = (None, self.per_entry_height)
 
-class YTDLDownloadQueueScroller(ScrollView):
+class YTDLDownloadQueueScroller(RecycleView):
+    # Only the rows on screen exist as widgets. The queue itself is just the
+    # list of DownloadEntry objects backing self.data.
     def __init__(self, ui_root, *args, **kwargs):
         super().__init__(*args, do_scroll_x = False, bar_pos_y='left', bar_width=10, always_overscroll = False, scroll_type=['bars', 'content'], **kwargs)
         self.effect_cls = ScrollEffect
         self.ui_root = ui_root
-        self.contents = YTDLDownloadQueueContents(ui_root, size_hint_x=1.0, size_hint_y=None, height=10)
+        self.entries: T.List[DownloadEntry] = []
+        # Last row each entry was bound to, so updates can go straight to it
+        self.rows: T.Dict[str, YTDLQueueEntry] = {}
+        # Entries that changed since the last frame
+        self.dirty: T.Dict[str, DownloadEntry] = {}
+        self.dirty_lock = threading.Lock()
+        self.flush_dirty_trigger = Clock.create_trigger(self.flush_dirty)
+
+        self.contents = YTDLDownloadQueueContents(size_hint_x=1.0, size_hint_y=None, height=10)
         self.add_widget(self.contents)
+        self.viewclass = YTDLQueueEntry
         self.bind(height=self.on_height_changed)
         self.on_height_changed(self, self.height)
+        self.load_saved()
         
         self.bar_color = (0.7, 0.7, 1.0, 0.9)
         self.bar_inactive_color = (0.7, 0.7, 0.7, 0.7)
 
-    def refresh_all(self):
-        self.contents.refresh_all()
+    def track_row(self, row: YTDLQueueEntry, info: DownloadEntry):
+        if row.info is not None and self.rows.get(row.info.id) is row:
+            del self.rows[row.info.id]
+        self.rows[info.id] = row
 
-    def select_entry(self, wdg):
-        self.scroll_to(wdg)
+    def refresh_entry(self, info: DownloadEntry):
+        row = self.rows.get(info.id)
+        if row is not None and row.info is info:
+            row.refresh_from_info()
 
-    def add_new_download(self, url=None):
-        wdg = self.contents.add_new_download(url)
-        if wdg is not None:
-            self.ui_root.select_entry(wdg)
+    def refresh_progress(self, entry_id: str):
+        row = self.rows.get(entry_id)
+        if row is not None and row.info is not None and row.info.id == entry_id:
+            row.refresh_description()
+
+    def refresh_all(self):
+        # Only touches the rows that are actually on screen
+        self.refresh_from_data()
+
+    def select_entry(self, info: DownloadEntry):
+        if info not in self.entries:
+            return
+        index = self.entries.index(info)
+        row_height = self.contents.per_entry_height
+        scrollable = self.contents.height - self.height
+        if scrollable <= 0:
+            return
+
+        # Distance from the top of the list to the top of the viewport
+        viewport_top = (1.0 - self.scroll_y) * scrollable
+        row_top = index * row_height
+        if row_top < viewport_top:
+            viewport_top = row_top
+        elif row_top + row_height > viewport_top + self.height:
+            viewport_top = row_top + row_height - self.height
+        else:
+            # Already visible
+            return
+        self.scroll_y = 1.0 - min(max(viewport_top / scrollable, 0.0), 1.0)
+
+    def _watch(self, info: DownloadEntry):
+        info.bind(changed=self._on_entry_changed)
+
+    def _on_entry_changed(self, info: DownloadEntry, fields: T.Tuple[str, ...]):
+        # Can come from any thread. Just remember it, the redraw happens once
+        # per frame for everything that changed since the last one.
+        self.mark_dirty(info)
+
+    def mark_dirty(self, info: DownloadEntry):
+        with self.dirty_lock:
+            self.dirty[info.id] = info
+        self.flush_dirty_trigger()
+
+    def flush_dirty(self, *args):
+        with self.dirty_lock:
+            dirty = self.dirty
+            self.dirty = {}
+        for each_entry in dirty.values():
+            self.refresh_entry(each_entry)
+        selected = self.ui_root.selected
+        if selected is not None and selected.id in dirty:
+            self.ui_root.details.refresh()
+
+    def load_saved(self):
+        # Bring back whatever was in the queue last time
+        saved = job_store.load_all()
+        for each_entry in saved:
+            self._watch(each_entry)
+        self.entries.extend(saved)
+        self.data.extend([{"info": info} for info in saved])
+        for each_entry in saved:
+            if each_entry.meta is None and each_entry.url is not None:
+                # Never got resolved before we shut down
+                each_entry.set_url_async(each_entry.url)
+
+    def _make_entry(self, url=None, meta=None) -> DownloadEntry:
+        info = DownloadEntry()
+        self._watch(info)
+        if meta is not None:
+            info.set_meta(url, meta)
+        else:
+            # Not resolved yet, that happens once it's in the job store
+            info.url = url
+        return info
+
+    def _add_entries(self, new_entries: T.List[DownloadEntry]):
+        job_store.add_many(new_entries)
+        self.entries.extend(new_entries)
+        self.data.extend([{"info": info} for info in new_entries])
+        for each_entry in new_entries:
+            # Already downloaded before, no need to look anything up
+            if each_entry.check_archive():
+                continue
+            if each_entry.meta is None:
+                # Shows up as "Resolving..." until the lookup comes back
+                each_entry.set_url_async(each_entry.url)
+
+    def queued_keys(self) -> T.Dict[T.Tuple[T.Optional[str], str], DownloadEntry]:
+        # (video ID, profile) -> the entry that has it, for spotting duplicates
+        return {e.archive_key(): e for e in reversed(self.entries) if e.video_id() is not None}
+
+    def add_new_download(self, url=None, select=True, meta=None) -> DownloadEntry:
+        info = self._make_entry(url, meta)
+        duplicate = self.queued_keys().get(info.archive_key()) if info.video_id() is not None else None
+        if duplicate is not None:
+            print("WARNING: That video is already in the queue.", file=sys.stderr)
+            info = duplicate
+        else:
+            self._add_entries([info])
+        if select:
+            self.ui_root.select_entry(info)
+        return info
+
+    def add_new_downloads(self, urls: T.Sequence[str], metas: T.Optional[T.Dict[str, T.Any]] = None) -> T.List[DownloadEntry]:
+        # Adds a whole batch with a single update to the view. Videos that
+        # are already queued are left out.
+        metas = metas if metas is not None else {}
+        queued = self.queued_keys()
+        new_entries = []
+        for each_url in urls:
+            info = self._make_entry(each_url, metas.get(each_url))
+            if info.video_id() is not None and info.archive_key() in queued:
+                continue
+            queued[info.archive_key()] = info
+            new_entries.append(info)
+        self._add_entries(new_entries)
+        return new_entries
 
     def on_height_changed(self, inst, val):
         self.contents.per_entry_height = self.height // 10
     
-    def remove_queue_entry(self, wdg):
-        self.contents.remove_queue_entry(wdg)
+    def remove_queue_entry(self, info: DownloadEntry):
+        if info in self.entries:
+            index = self.entries.index(info)
+            self.entries.pop(index)
+            self.data.pop(index)
+            self.rows.pop(info.id, None)
+            job_store.remove(info)
         self.refresh_all()
 
-    def get_first_download(self) -> T.Optional[YTDLQueueEntry]:
-        return self.contents.get_first_download()
+    def get_downloadable(self) -> T.List[DownloadEntry]:
+        # The same video twice only gets downloaded once, the second one
+        # finds it in the archive later
+        downloadable = []
+        seen = set()
+        for each_entry in self.entries:
+            if not each_entry.is_downloadable():
+                continue
+            key = each_entry.archive_key()
+            if key[0] is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            downloadable.append(each_entry)
+        return downloadable
 
     def sync_all_get_subtitles(self, new_get_subtitles: bool):
-        self.contents.sync_all_get_subtitles(new_get_subtitles)
+        for each_entry in self.entries:
+            each_entry.set_download_subtitles(new_get_subtitles)
 
 
 class YTDLConfigEntryView(BoxLayout):
@@ -427,7 +649,7 @@ class YTDLDetailView(BoxLayout):
     def __init__(self, ui_root, *args, **kwargs):
         super().__init__(*args, orientation='vertical', **kwargs)
         self.ui_root = ui_root
-        self.thumbnail = AsyncImage(source=PLACEHOLDER_IMG, size_hint=(1.0, 0.5), allow_stretch=True)
+        self.thumbnail = Thumbnail("detail", size_hint=(1.0, 0.5), allow_stretch=True)
         self.config_entry = YTDLConfigEntryView(ui_root, size_hint=(1.0, 0.5))
         self.add_widget(self.thumbnail)
         self.add_widget(self.config_entry)
@@ -470,19 +692,21 @@ class YTDLDetailView(BoxLayout):
         clean = lambda s: " ".join(s.split()).strip()
 
         if self.selected_download is not None:
-            self.selected_download.set_url(none_for_empty(clean(self.config_entry.txt_url.text)))
-            self.selected_download.title = none_for_empty(clean(self.config_entry.txt_title.text))
-            self.selected_download.author = none_for_empty(clean(self.config_entry.txt_author.text))
-            self.selected_download.subtitles = self.config_entry.chk_subtitles.active
-            self.sync_all_get_subtitles(self.selected_download.subtitles)
-            self.selected_download.burn_subtitles = self.config_entry.chk_burnsubs.active
-            self.selected_download.audio_only = self.config_entry.dltype_audio.state == 'down'
+            self.selected_download.set_url_async(none_for_empty(clean(self.config_entry.txt_url.text)))
+            self.selected_download.set_title(none_for_empty(clean(self.config_entry.txt_title.text)))
+            self.selected_download.set_author(none_for_empty(clean(self.config_entry.txt_author.text)))
+            if self.selected_download.subtitles != self.config_entry.chk_subtitles.active:
+                # Only touch the rest of the queue when it actually changed
+                self.selected_download.set_download_subtitles(self.config_entry.chk_subtitles.active)
+                self.sync_all_get_subtitles(self.selected_download.subtitles)
+            self.selected_download.set_burn_subtitles(self.config_entry.chk_burnsubs.active)
+            self.selected_download.set_download_type(self.config_entry.dltype_audio.state == 'down')
             self.refresh()
 
 
     def refresh(self):
         if self.selected_download is not None:
-            self.thumbnail.source = self.selected_download.vthumbnail()
+            self.thumbnail.show(self.selected_download.vthumbnail())
             self.config_entry.txt_url.text = self.selected_download.url if self.selected_download.url is not None else ""
             self.config_entry.txt_title.text = self.selected_download.otitle()
             self.config_entry.txt_author.text = self.selected_download.oauthor()
@@ -496,6 +720,7 @@ class YTDLDetailView(BoxLayout):
                 self.config_entry.dltype_video.state = 'down'
             self.editable = self.selected_download.editable
         else:
+            self.thumbnail.show(PLACEHOLDER_IMG)
             self.config_entry.txt_url.text = ""
             self.config_entry.txt_title.text = ""
             self.config_entry.txt_author.text = ""
@@ -504,7 +729,6 @@ class YTDLDetailView(BoxLayout):
             self.config_entry.dltype_audio.state = 'normal'
             self.config_entry.dltype_video.state = 'normal'
             self.editable = False
-        self.ui_root.dl_queue.refresh_all()
 
 class YTDLRoot(BoxLayout):
     def __init__(self, *args, **kwargs):
@@ -528,61 +752,66 @@ class YTDLRoot(BoxLayout):
         self.add_widget(self.controls)
         self.add_widget(self.main_body)
         self.add_widget(self.progress_body)
-        self.bound_wdg = None
-
-        self.current_download = None
+        # The DownloadEntry shown in the detail view
+        self.selected: T.Optional[DownloadEntry] = None
 
         self.hide_details()
+        Clock.schedule_interval(self.on_dl_progress, 0)
 
 
     def sync_all_get_subtitles(self, new_get_subtitles: bool):
         self.dl_queue.sync_all_get_subtitles(new_get_subtitles)
 
 
-    def select_entry(self, wdg):
-        is_new = not (self.bound_wdg == wdg)
-        if wdg is not None:
+    def select_entry(self, info: DownloadEntry):
+        is_new = not (self.selected is info)
+        if info is not None:
             self.deselect()
             if is_new:
-                self.bound_wdg = wdg
-                self.dl_queue.select_entry(wdg)
-                self.details.populate(wdg.info)
-                wdg.select()
+                self.selected = info
+                self.dl_queue.select_entry(info)
+                self.details.populate(info)
                 self.show_details()
-                self.refresh()
+                self.dl_queue.mark_dirty(info)
     
     def deselect(self):
         # Whenever you deselect, make sure updates get pushed
         self.details.update_info()
         self.details.populate(None)
-        if self.bound_wdg is not None:
-            self.bound_wdg.deselect()
-            self.bound_wdg = None
+        previous = self.selected
+        self.selected = None
         self.hide_details()
-        self.refresh()
+        if previous is not None:
+            self.dl_queue.mark_dirty(previous)
 
-    def remove_queue_entry(self, wdg):
+    def remove_queue_entry(self, info: DownloadEntry):
         self.deselect()
-        self.dl_queue.remove_queue_entry(wdg)
-
-    def refresh(self):
-        self.details.refresh()
-        self.dl_queue.refresh_all()
-
-    def reset_progress(self, *args):
-        self.lbl_progress.text = "Downloading"
-        self.progress.value = 0
-
-    def on_dl_progress(self, inst, val):
-        self.progress.value = int(val * 100)
-        if self.progress.value >= 99:
-            self.lbl_progress.text = "Converting"
+        self.dl_queue.remove_queue_entry(info)
+
+    def on_dl_progress(self, *args):
+        # Runs every frame, but only does anything if some download moved
+        changed = progress_hub.take_changed()
+        if len(changed) == 0:
+            return
+        for each_id in changed:
+            self.dl_queue.refresh_progress(each_id)
+
+        queue_progress = progress_hub.aggregate()
+        self.progress.value = int(queue_progress.fraction() * 100)
+        # Queued downloads count as running, so this is only done once they're all through
+        active = queue_progress.running - queue_progress.queued
+        if queue_progress.running == 0:
+            self.on_dl_done(queue_progress)
+        elif active == 0:
+            self.lbl_progress.text = f"Waiting ({queue_progress.queued} queued, {queue_progress.finished}/{queue_progress.jobs} done)"
+        elif active == queue_progress.converting:
+            self.lbl_progress.text = f"Converting ({queue_progress.finished}/{queue_progress.jobs} done, {queue_progress.queued} queued)"
         else:
-            self.lbl_progress.text = "Downloading"
+            self.lbl_progress.text = f"Downloading {active} ({format_rate(queue_progress.rate)}, {format_eta(queue_progress.eta)} left, {queue_progress.queued} queued)"
     
-    def on_dl_done(self, inst, val):
-        self.progress.value = 100 if val else 0
-        self.lbl_progress.text = "Done!"
+    def on_dl_done(self, queue_progress):
+        self.progress.value = 100
+        self.lbl_progress.text = f"Done! ({queue_progress.finished}/{queue_progress.jobs})"
 
     def show_details(self):
         if self.details not in self.main_body.children:
@@ -592,16 +821,21 @@ class YTDLRoot(BoxLayout):
         if self.details in self.main_body.children:
             self.main_body.remove_widget(self.details)
         
-    def get_first_download(self) -> T.Optional[YTDLQueueEntry]:
-        return self.dl_queue.get_first_download()
-    
     def download_all(self, *args):
-        item = self.get_first_download()
-        while item is not None:
-            item.on_dl_pressed()
-            item = self.get_first_download()
+        # Push any pending edits first, then hand everything to the scheduler
+        self.details.update_info()
+        # One pass, download() takes each one out of the running anyway
+        for each_entry in self.dl_queue.get_downloadable():
+            each_entry.download()
             
 
 class YTDLApp(App):
     def build(self):
+        # Off unless the environment says where to put them (see metrics)
+        metrics.configure_from_env()
         return YTDLRoot()
+
+    def on_stop(self):
+        # Push any pending edits, and make sure the queue on disk is current
+        self.root.details.update_info()
+        job_store.flush()